@@ -1,45 +1,110 @@
 import re
-import nltk
-from bs4 import BeautifulSoup
-from nltk.corpus import stopwords
-from pymystem3 import Mystem
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
 from string import punctuation
-from transformers import BertTokenizer
 
-nltk.download("stopwords")
+from bs4 import BeautifulSoup
+
+# mystem keeps punctuation between words as is, so it splits a batch back into texts
+SEPARATOR = " | "
+
+_mystem = None
+_mystem_lock = threading.Lock()  # the process talks over one pair of pipes, a request at a time
+_stopwords = None
+
+
+def get_mystem():
+    """ one long-lived mystem process for the whole python process """
+    global _mystem
+    if _mystem is None:
+        from pymystem3 import Mystem
+        _mystem = Mystem(entire_input=True)
+    return _mystem
+
 
+def get_stopwords():
+    global _stopwords
+    if _stopwords is None:
+        import nltk
+        from nltk.corpus import stopwords
+        try:
+            words = stopwords.words("russian")
+        except LookupError:
+            nltk.download("stopwords", quiet=True)
+            words = stopwords.words("russian")
+        _stopwords = frozenset(words)
+    return _stopwords
 
-def get_clear_text(text):
+
+def clear_html(text):
     soup = BeautifulSoup(text, 'html.parser')
 
     # extract the plain text from the HTML document without tags
-    clear_text = ''
-    for tag in soup.find_all():
-        clear_text += tag.string or ''
+    return clear_plain(soup.get_text(" "))
+
 
-    clear_text = re.sub(pattern='[\u202F\u00A0\n]+', repl=' ', string=clear_text)
+def clear_plain(text):
+    clear_text = re.sub(pattern='[\u202F\u00A0\n]+', repl=' ', string=text)
 
     # only words
     clear_text = re.sub(pattern='[^A-ZА-ЯЁ -]', repl='', string=clear_text, flags=re.IGNORECASE)
 
     clear_text = re.sub(pattern='\s+', repl=' ', string=clear_text)
 
-    clear_text = clear_text.lower()
+    return clear_text.lower()
+
+
+def preprocess_many(texts, html=True):
+    """ lemmatized texts without stopwords, all of them in one mystem round trip """
+    if not texts:
+        return []
+    russian_stopwords = get_stopwords()
+    clear = clear_html if html else clear_plain
+    batch = SEPARATOR.join(clear(text) for text in texts)
+    with _mystem_lock:
+        tokens = get_mystem().lemmatize(batch)
+
+    results = [[]]
+    for token in tokens:
+        if "|" in token:
+            # empty texts end up in one token with both separators
+            results += [[] for _ in range(token.count("|"))]
+        elif token not in russian_stopwords and token != " " and token.strip() not in punctuation:
+            results[-1].append(token)
+
+    return [" ".join(result) for result in results]
 
-    mystem = Mystem()
-    russian_stopwords = stopwords.words("russian")
 
-    tokens = mystem.lemmatize(clear_text)
-    tokens = [token for token in tokens if token not in russian_stopwords \
-              and token != " " \
-              and token.strip() not in punctuation]
+def get_clear_text(text, html=True):
+    return preprocess_many([text], html)[0]
 
-    clear_text = " ".join(tokens)
 
-    return clear_text
+def preprocess_corpus(texts, processes=None, batch_size=100):
+    """
+    lemmatizes the iterable of texts in a pool of processes with a mystem in each,
+    yields the results in order, only a few batches are kept in memory at once
+    """
+    processes = processes or cpu_count() or 1
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        batch = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) == batch_size:
+                pending.append(pool.submit(preprocess_many, batch))
+                batch = []
+                if len(pending) > 2 * processes:
+                    yield from pending.popleft().result()
+        if batch:
+            pending.append(pool.submit(preprocess_many, batch))
+        while pending:
+            yield from pending.popleft().result()
 
 
 # if __name__ == '__main__':
+#     from transformers import BertTokenizer
 #
 #     # initialize the tokenizer with the pre-trained BERT model and vocabulary
 #     tokenizer = BertTokenizer.from_pretrained('bert-base-multilingual-cased')
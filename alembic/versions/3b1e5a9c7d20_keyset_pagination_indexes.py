@@ -0,0 +1,36 @@
+"""keyset pagination indexes
+
+Revision ID: 3b1e5a9c7d20
+Revises: fe943b098418
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b1e5a9c7d20'
+down_revision: Union[str, None] = 'fe943b098418'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_shout_published_at_id", "shout", '"publishedAt", id'),
+    ("ix_shout_created_at_id", "shout", '"createdAt", id'),
+    ("ix_reaction_created_at_id", "reaction", '"createdAt", id'),
+]
+
+
+def upgrade() -> None:
+    # init_tables() creates them on a fresh database, hence IF NOT EXISTS
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON "{table}" ({columns})')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _table, _columns in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
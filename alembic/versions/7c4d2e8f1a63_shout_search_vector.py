@@ -0,0 +1,44 @@
+"""shout full-text search vector
+
+Revision ID: 7c4d2e8f1a63
+Revises: 3b1e5a9c7d20
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c4d2e8f1a63'
+down_revision: Union[str, None] = '3b1e5a9c7d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# a copy of orm.shout.SEARCH_VECTOR at the time of this revision
+SEARCH_CONFIG = "CASE WHEN lang = 'en' THEN 'english'::regconfig ELSE 'russian'::regconfig END"
+SEARCH_VECTOR = (
+    f"setweight(to_tsvector({SEARCH_CONFIG}, coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector({SEARCH_CONFIG}, coalesce(subtitle, '') || ' ' || coalesce(lead, '')), 'B') || "
+    f"setweight(to_tsvector({SEARCH_CONFIG}, coalesce(body, '')), 'D')"
+)
+
+
+def upgrade() -> None:
+    # init_tables() creates both on a fresh database, hence IF NOT EXISTS
+    op.execute(
+        f'ALTER TABLE shout ADD COLUMN IF NOT EXISTS "searchVector" tsvector '
+        f'GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED'
+    )
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_shout_search_vector '
+            'ON shout USING gin ("searchVector")'
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_shout_search_vector')
+    op.execute('ALTER TABLE shout DROP COLUMN IF EXISTS "searchVector"')
@@ -2,17 +2,18 @@ from functools import wraps
 from typing import Optional, Tuple
 
 from graphql.type import GraphQLResolveInfo
-from sqlalchemy.orm import joinedload, exc
+from sqlalchemy import select
 from starlette.authentication import AuthenticationBackend
 from starlette.requests import HTTPConnection
 
 from auth.credentials import AuthCredentials, AuthUser
-from base.orm import local_session
-from orm.user import User, Role
+from auth.sessioncache import session_cache
+from base.orm import async_session
+from orm.user import User
 
 from settings import SESSION_TOKEN_HEADER
 from auth.tokenstorage import SessionToken
-from base.exceptions import OperationNotAllowed
+from base.exceptions import ExpiredToken, InvalidToken, OperationNotAllowed
 
 
 class JWTAuthenticate(AuthenticationBackend):
@@ -31,31 +32,37 @@ class JWTAuthenticate(AuthenticationBackend):
             )
 
         if len(token.split('.')) > 1:
-            payload = await SessionToken.verify(token)
-
-            with local_session() as session:
+            cached = session_cache.get(token)
+            if cached is None:
                 try:
-                    user = (
-                        session.query(User).options(
-                            joinedload(User.roles).options(joinedload(Role.permissions)),
-                            joinedload(User.ratings)
-                        ).filter(
-                            User.id == payload.user_id
-                        ).one()
+                    payload = await SessionToken.verify(token)
+                except (ExpiredToken, InvalidToken) as e:
+                    # a revoked or expired token makes an anonymous request, not an error
+                    print("[auth.authenticate] %s" % e.message)
+                    return AuthCredentials(scopes={}, error_message=e.message), AuthUser(
+                        user_id=None, username=''
                     )
 
-                    scopes = {}  # TODO: integrate await user.get_permission()
+                async with async_session() as session:
+                    user_id = (
+                        await session.execute(select(User.id).where(User.id == payload.user_id))
+                    ).scalar_one_or_none()
 
-                    return (
-                        AuthCredentials(
-                            user_id=payload.user_id,
-                            scopes=scopes,
-                            logged_in=True
-                        ),
-                        AuthUser(user_id=user.id, username=''),
-                    )
-                except exc.NoResultFound:
-                    pass
+                if user_id is not None:
+                    scopes = {}  # TODO: integrate await user.get_permission()
+                    session_cache.set(token, user_id, scopes, payload.exp)
+                    cached = (user_id, scopes)
+
+            if cached is not None:
+                user_id, scopes = cached
+                return (
+                    AuthCredentials(
+                        user_id=user_id,
+                        scopes=scopes,
+                        logged_in=True
+                    ),
+                    AuthUser(user_id=user_id, username=''),
+                )
 
         return AuthCredentials(scopes={}, error_message=str('Invalid token')), AuthUser(user_id=None, username='')
 
@@ -1,8 +1,6 @@
-import requests
+from services.outbox import EmailOutbox
+from settings import MAILGUN_DOMAIN
 
-from settings import MAILGUN_API_KEY, MAILGUN_DOMAIN
-
-api_url = "https://api.mailgun.net/v3/%s/messages" % (MAILGUN_DOMAIN or 'discours.io')
 noreply = "discours.io <noreply@%s>" % (MAILGUN_DOMAIN or 'discours.io')
 lang_subject = {
     "ru": "Подтверждение почты",
@@ -11,27 +9,24 @@ lang_subject = {
 
 
 async def send_auth_email(user, token, lang="ru", template="email_confirmation"):
+    """ queues the email, EmailOutbox.worker sends it """
     try:
         to = "%s <%s>" % (user.name, user.email)
         if lang not in ['ru', 'en']:
             lang = 'ru'
         subject = lang_subject.get(lang, lang_subject["en"])
         template = template + "_" + lang
-        payload = {
+        message = {
             "from": noreply,
             "to": to,
+            "email": user.email,
             "subject": subject,
             "template": template,
-            "h:X-Mailgun-Variables": "{ \"token\": \"%s\" }" % token
+            "variables": {"token": token}
         }
-        print('[auth.email] payload: %r' % payload)
+        print('[auth.email] queued %s to %s' % (template, user.email))
         # debug
         # print('http://localhost:3000/?modal=auth&mode=confirm-email&token=%s' % token)
-        response = requests.post(
-            api_url,
-            auth=("api", MAILGUN_API_KEY),
-            data=payload
-        )
-        response.raise_for_status()
+        await EmailOutbox.push(message)
     except Exception as e:
         print(e)
@@ -1,19 +1,27 @@
+import asyncio
 from binascii import hexlify
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 
 from jwt import DecodeError, ExpiredSignatureError
 from passlib.hash import bcrypt
-from sqlalchemy import or_
+from sqlalchemy import or_, update
 
 from auth.jwtcodec import JWTCodec
 from auth.tokenstorage import TokenStorage
-# from base.exceptions import InvalidPassword, InvalidToken
+from base.exceptions import InvalidPassword, TooManyRequests
 from base.orm import local_session
 from orm import User
+from settings import PASSWORD_HASH_QUEUE, PASSWORD_HASH_ROUNDS, PASSWORD_HASH_THREADS
 from validations.auth import AuthInput
 
 
 class Password:
+    # bcrypt releases the GIL, so a few threads keep the event loop free
+    executor = ThreadPoolExecutor(PASSWORD_HASH_THREADS, thread_name_prefix="password")
+    running = asyncio.Semaphore(PASSWORD_HASH_THREADS)
+    waiting = 0  # queue depth
+
     @staticmethod
     def _to_bytes(data: str) -> bytes:
         return bytes(data.encode())
@@ -26,7 +34,12 @@ class Password:
     @staticmethod
     def encode(password: str) -> str:
         password_sha256 = Password._get_sha256(password)
-        return bcrypt.using(rounds=10).hash(password_sha256)
+        return bcrypt.using(rounds=PASSWORD_HASH_ROUNDS).hash(password_sha256)
+
+    @staticmethod
+    def needs_update(hashed: str) -> bool:
+        """ True if the hash was made with another cost than configured now """
+        return bcrypt.using(rounds=PASSWORD_HASH_ROUNDS).needs_update(hashed)
 
     @staticmethod
     def verify(password: str, hashed: str) -> bool:
@@ -50,21 +63,47 @@ class Password:
 
         return bcrypt.verify(password_sha256, hashed_bytes)
 
+    @staticmethod
+    async def run(func, *args):
+        """ runs the hashing :func in the executor, refuses when too many are waiting """
+        self = Password
+        if self.waiting >= PASSWORD_HASH_QUEUE:
+            print("[auth.identity] %d password hashings are waiting, refused" % self.waiting)
+            raise TooManyRequests("too many sign in attempts, try again later")
+        self.waiting += 1
+        try:
+            await self.running.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.running.release()
+
+    @staticmethod
+    async def encode_async(password: str) -> str:
+        return await Password.run(Password.encode, password)
+
+    @staticmethod
+    async def verify_async(password: str, hashed: str) -> bool:
+        return await Password.run(Password.verify, password, hashed)
+
 
 class Identity:
     @staticmethod
-    def password(orm_user: User, password: str) -> User:
+    async def password(orm_user: User, password: str) -> User:
         user = User(**orm_user.dict())
         if not user.password:
-            # raise InvalidPassword("User password is empty")
-            return {
-                "error": "User password is empty"
-            }
-        if not Password.verify(password, user.password):
-            # raise InvalidPassword("Wrong user password")
-            return {
-                "error": "Wrong user password"
-            }
+            raise InvalidPassword("User password is empty")
+        if not await Password.verify_async(password, user.password):
+            raise InvalidPassword("Wrong user password")
+        if Password.needs_update(user.password):
+            # the password is known only now, so the cost is changed on sign in
+            user.password = await Password.encode_async(password)
+            with local_session() as session:
+                session.execute(update(User).where(User.id == user.id).values(password=user.password))
+                session.commit()
+            print("[auth.identity] user %d password rehashed" % user.id)
         return user
 
     @staticmethod
@@ -89,7 +128,7 @@ class Identity:
         try:
             print('[auth.identity] using one time token')
             payload = JWTCodec.decode(token)
-            if not await TokenStorage.exist(f"{payload.user_id}-{payload.username}-{token}"):
+            if not await TokenStorage.exist(payload, token):
                 # raise InvalidToken("Login token has expired, please login again")
                 return {
                     "error": "Token has expired"
@@ -1,3 +1,4 @@
+import secrets
 from datetime import datetime, timezone
 import jwt
 from base.exceptions import ExpiredToken, InvalidToken
@@ -7,13 +8,14 @@ from settings import JWT_ALGORITHM, JWT_SECRET_KEY
 
 class JWTCodec:
     @staticmethod
-    def encode(user: AuthInput, exp: datetime) -> str:
+    def encode(user: AuthInput, exp: datetime, jti: str = None) -> str:
         payload = {
             "user_id": user.id,
             "username": user.email or user.phone,
             "exp": exp,
             "iat": datetime.now(tz=timezone.utc),
-            "iss": "discours"
+            "iss": "discours",
+            "jti": jti or secrets.token_urlsafe(12)
         }
         try:
             return jwt.encode(payload, JWT_SECRET_KEY, JWT_ALGORITHM)
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from base.redis import redis
+from settings import SESSION_CACHE_SIZE, SESSION_CACHE_TTL
+
+REVOKED_CHANNEL = "sessions/revoked"
+
+
+class SessionCache:
+    """
+    Bounded LRU cache of verified session tokens: token -> (user_id, scopes).
+    Every worker keeps its own copy, revoked tokens are evicted
+    through redis pub/sub, see TokenStorage.revoke and revoke_all
+    """
+
+    def __init__(self, size=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()  # token -> (expires_at, user_id, scopes)
+        self.by_user = {}  # user_id -> set of cached tokens
+
+    def get(self, token):
+        entry = self.data.get(token)
+        if entry is None:
+            return None
+        expires_at, user_id, scopes = entry
+        if expires_at < time.time():
+            self.remove(token)
+            return None
+        self.data.move_to_end(token)
+        return user_id, scopes
+
+    def set(self, token, user_id, scopes, exp):
+        expires_at = min(time.time() + self.ttl, exp)
+        self.data[token] = (expires_at, user_id, scopes)
+        self.data.move_to_end(token)
+        self.by_user.setdefault(user_id, set()).add(token)
+        while len(self.data) > self.size:
+            oldest = next(iter(self.data))
+            self.remove(oldest)
+
+    def remove(self, token):
+        entry = self.data.pop(token, None)
+        if entry is not None:
+            user_id = entry[1]
+            tokens = self.by_user.get(user_id, set())
+            tokens.discard(token)
+            if not tokens:
+                self.by_user.pop(user_id, None)
+
+    def remove_user(self, user_id):
+        for token in list(self.by_user.get(user_id, [])):
+            self.remove(token)
+
+    def clear(self):
+        self.data.clear()
+        self.by_user.clear()
+
+    @staticmethod
+    async def revoke(token=None, user_id=None):
+        """ notifies all the workers, including this one """
+        await redis.publish(REVOKED_CHANNEL, json.dumps({
+            "token": token,
+            "user_id": user_id
+        }))
+
+    async def on_revoked(self, data):
+        message = json.loads(data)
+        if message.get("token"):
+            self.remove(message["token"])
+        if message.get("user_id"):
+            self.remove_user(message["user_id"])
+
+    async def worker(self):
+        """ async task worker listening for revoked sessions """
+        while True:
+            try:
+                await redis.listen(REVOKED_CHANNEL, self.on_revoked)
+            except Exception as e:
+                print("[auth.sessioncache] listener error: %s" % e)
+            # revocations could be missed while disconnected
+            self.clear()
+            await asyncio.sleep(1)
+
+
+session_cache = SessionCache()
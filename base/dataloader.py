@@ -0,0 +1,75 @@
+import asyncio
+
+LOADERS = {}
+
+
+def loader(name):
+    """
+    Registers a batch function as :name loader,
+    it gets a list of keys and returns the values in the same order
+    """
+    def decorator(batch_load_fn):
+        LOADERS[name] = batch_load_fn
+        return batch_load_fn
+
+    return decorator
+
+
+class DataLoader:
+    """ keys requested within one event loop tick are fetched with one batch call """
+
+    def __init__(self, batch_load_fn):
+        self.batch_load_fn = batch_load_fn
+        self.cache = {}  # key -> future
+        self.queue = []
+
+    def load(self, key):
+        future = self.cache.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            self.cache[key] = future
+            self.queue.append(key)
+            if len(self.queue) == 1:
+                loop.call_soon(lambda: asyncio.ensure_future(self.dispatch()))
+        return future
+
+    def load_many(self, keys):
+        return asyncio.gather(*[self.load(key) for key in keys])
+
+    async def dispatch(self):
+        keys, self.queue = self.queue, []
+        try:
+            values = await self.batch_load_fn(keys)
+            if len(values) != len(keys):
+                # the futures left unresolved would hang their requests
+                raise ValueError("%s returned %d values for %d keys" % (
+                    self.batch_load_fn.__name__, len(values), len(keys)
+                ))
+            for key, value in zip(keys, values):
+                self.cache[key].set_result(value)
+        except Exception as e:
+            print("[base.dataloader] batch error: %s" % e)
+            for key in keys:
+                future = self.cache.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+
+
+class Loaders:
+    """ request scoped loaders: await info.context["loaders"]["user"].load(user_id) """
+
+    def __init__(self):
+        self._loaders = {}
+
+    def __getitem__(self, name):
+        if name not in self._loaders:
+            self._loaders[name] = DataLoader(LOADERS[name])
+        return self._loaders[name]
+
+
+def context_value(request, _data=None):
+    return {
+        "request": request,
+        "loaders": Loaders()
+    }
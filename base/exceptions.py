@@ -36,3 +36,8 @@ class OperationNotAllowed(BaseHttpException):
 class InvalidPassword(BaseHttpException):
     code = 403
     message = "403 Invalid Password"
+
+
+class TooManyRequests(BaseHttpException):
+    code = 429
+    message = "429 Too Many Requests"
@@ -1,16 +1,23 @@
 from typing import TypeVar, Any, Dict, Generic, Callable
 
 from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.schema import Table
 
-from settings import DB_URL
+from settings import DB_URL, ASYNC_DB_URL
 
 engine = create_engine(
     DB_URL, echo=False, pool_size=10, max_overflow=20
 )
 
+# asyncpg engine for resolvers, the queries are awaited
+# instead of blocking the event loop
+async_engine = create_async_engine(
+    ASYNC_DB_URL, echo=False, pool_size=10, max_overflow=20
+)
+
 T = TypeVar("T")
 
 REGISTRY: Dict[str, type] = {}
@@ -20,6 +27,19 @@ def local_session():
     return Session(bind=engine, expire_on_commit=False)
 
 
+def async_session():
+    """
+    Usage in async resolvers instead of local_session():
+
+        async with async_session() as session:
+            result = await session.execute(q)
+
+    lazy relationship loading is not available here,
+    so every relationship used must be loaded eagerly
+    """
+    return AsyncSession(bind=async_engine, expire_on_commit=False)
+
+
 class Base(declarative_base()):
     __table__: Table
     __tablename__: str
@@ -52,5 +72,6 @@ class Base(declarative_base()):
                 setattr(self, name, value)
 
     def dict(self) -> Dict[str, Any]:
-        column_names = self.__table__.columns.keys()
-        return {c: getattr(self, c) for c in column_names}
+        # computed columns like the search vector are deferred and never part of a payload
+        columns = [c for c in self.__table__.columns if c.computed is None]
+        return {c.key: getattr(self, c.key) for c in columns}
@@ -1,8 +1,43 @@
-from aioredis import from_url
+import json
 from asyncio import sleep
+from contextlib import asynccontextmanager
+from hashlib import sha1
+
+from aioredis import from_url
+from aioredis.exceptions import NoScriptError
+
 from settings import REDIS_URL
 
 
+class RedisPipeline:
+    """
+    Queues commands to be sent in one round trip,
+    execute() here is not awaited unlike RedisCache.execute()
+    """
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+        self.results = []
+
+    def execute(self, command, *args, **kwargs):
+        self._pipe.execute_command(command, *args, **kwargs)
+
+    def lpush_many(self, keys, *values):
+        """ pushes :values to every list of :keys """
+        for key in keys:
+            self._pipe.execute_command("LPUSH", key, *values)
+
+    def sadd_many(self, keys, *members):
+        """ adds :members to every set of :keys """
+        for key in keys:
+            self._pipe.execute_command("SADD", key, *members)
+
+    async def flush(self):
+        if len(self._pipe):
+            self.results += await self._pipe.execute()
+        return self.results
+
+
 class RedisCache:
     def __init__(self, uri=REDIS_URL):
         self._uri: str = uri
@@ -25,19 +60,95 @@ class RedisCache:
         while not self._instance:
             await sleep(1)
         try:
-            print("[redis] " + command + ' ' + ' '.join(args))
             return await self._instance.execute_command(command, *args, **kwargs)
-        except Exception:
-            pass
+        except Exception as e:
+            print("[redis] %s error: %s" % (command, e))
+
+    @asynccontextmanager
+    async def pipeline(self, transaction=False):
+        """
+        Usage:
+
+            async with redis.pipeline() as pipe:
+                pipe.execute("SET", key, value)
+                pipe.execute("LPUSH", other_key, item)
+            print(pipe.results)
+
+        queued commands are sent on exit, or earlier with await pipe.flush()
+        """
+        while not self._instance:
+            await sleep(1)
+        async with self._instance.pipeline(transaction=transaction) as pipe:
+            pipeline = RedisPipeline(pipe)
+            yield pipeline
+            await pipeline.flush()
+
+    def transaction(self):
+        """ pipeline wrapped with MULTI/EXEC """
+        return self.pipeline(transaction=True)
+
+    async def evalsha(self, script, keys=[], args=[]):
+        """ runs lua :script by its sha1, the script is sent only on first use """
+        while not self._instance:
+            await sleep(1)
+        sha = sha1(script.encode("utf-8")).hexdigest()
+        try:
+            return await self._instance.evalsha(sha, len(keys), *keys, *args)
+        except NoScriptError:
+            return await self._instance.eval(script, len(keys), *keys, *args)
+
+    async def publish(self, channel, data):
+        return await self.execute("PUBLISH", channel, data)
+
+    async def listen(self, channel, callback):
+        """ awaits :callback for every message published to :channel """
+        while not self._instance:
+            await sleep(1)
+        pubsub = self._instance.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    await callback(message["data"])
+        finally:
+            await pubsub.reset()
+
+    async def listen_pattern(self, pattern, callback):
+        """ awaits :callback(channel, data) for every message published to channels matching :pattern """
+        while not self._instance:
+            await sleep(1)
+        pubsub = self._instance.pubsub()
+        await pubsub.psubscribe(pattern)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "pmessage":
+                    await callback(message["channel"], message["data"])
+        finally:
+            await pubsub.reset()
 
     async def lrange(self, key, start, stop):
-        print(f"[redis] LRANGE {key} {start} {stop}")
         return await self._instance.lrange(key, start, stop)
 
     async def mget(self, key, *keys):
-        print(f"[redis] MGET {key} {keys}")
         return await self._instance.mget(key, *keys)
 
+    async def mget_json(self, keys):
+        """ values of :keys decoded from json, None for missing keys """
+        if not keys:
+            return []
+        values = await self.mget(*keys)
+        return [json.loads(v) if v else None for v in values]
+
+    async def lpush_many(self, keys, *values):
+        async with self.pipeline() as pipe:
+            pipe.lpush_many(keys, *values)
+        return pipe.results
+
+    async def sadd_many(self, keys, *members):
+        async with self.pipeline() as pipe:
+            pipe.sadd_many(keys, *members)
+        return pipe.results
+
 
 redis = RedisCache()
 
@@ -1,4 +1,6 @@
-from ariadne import MutationType, QueryType, SubscriptionType, ScalarType
+from datetime import datetime
+
+from ariadne import MutationType, ObjectType, QueryType, SubscriptionType, ScalarType
 
 
 datetime_scalar = ScalarType("DateTime")
@@ -6,10 +8,12 @@ datetime_scalar = ScalarType("DateTime")
 
 @datetime_scalar.serializer
 def serialize_datetime(value):
-    return value.isoformat()
+    # events coming from other workers carry it already serialized
+    return value.isoformat() if isinstance(value, datetime) else value
 
 
 query = QueryType()
 mutation = MutationType()
 subscription = SubscriptionType()
-resolvers = [query, mutation, subscription, datetime_scalar]
+shout_type = ObjectType("Shout")
+resolvers = [query, mutation, subscription, shout_type, datetime_scalar]
@@ -13,13 +13,21 @@ from orm import init_tables
 
 from auth.authenticate import JWTAuthenticate
 from auth.oauth import oauth_login, oauth_authorize
+from auth.sessioncache import session_cache
+from base.dataloader import context_value
+from base.orm import async_engine
 from base.redis import redis
 from base.resolvers import resolvers
 from resolvers.auth import confirm_email_handler
 from resolvers.upload import upload_handler
+from resolvers.zine.topics import topics_handler
+from services.following import FollowingManager
 from services.main import storages_init
+from services.outbox import EmailOutbox
+from services.search import SearchService
 from services.stat.viewed import ViewedStorage
 from services.zine.gittask import GitTask
+from services.zine.topicscache import TopicsCache
 from settings import DEV_SERVER_PID_FILE_NAME, SENTRY_DSN
 # from sse.transport import GraphQLSSEHandler
 from services.inbox.presence import on_connect, on_disconnect
@@ -27,6 +35,7 @@ from services.inbox.presence import on_connect, on_disconnect
 from ariadne.asgi.handlers import GraphQLTransportWSHandler
 
 import_module("resolvers")
+import_module("resolvers.zine.loaders")  # registers the request loaders
 schema = make_executable_schema(load_schema_from_path("schema.graphql"), resolvers)  # type: ignore
 
 middleware = [
@@ -43,6 +52,16 @@ async def start_up():
     print(views_stat_task)
     git_task = asyncio.create_task(GitTask.git_task_worker())
     print(git_task)
+    session_cache_task = asyncio.create_task(session_cache.worker())
+    print(session_cache_task)
+    search_task = asyncio.create_task(SearchService.worker())
+    print(search_task)
+    topics_cache_task = asyncio.create_task(TopicsCache.worker())
+    print(topics_cache_task)
+    outbox_task = asyncio.create_task(EmailOutbox.worker())
+    print(outbox_task)
+    following_task = asyncio.create_task(FollowingManager.worker())
+    print(following_task)
     try:
         import sentry_sdk
         sentry_sdk.init(SENTRY_DSN)
@@ -64,6 +83,7 @@ async def dev_start_up():
 
 async def shutdown():
     await redis.disconnect()
+    await async_engine.dispose()
 
 
 routes = [
@@ -71,7 +91,8 @@ routes = [
     Route("/oauth/{provider}", endpoint=oauth_login),
     Route("/oauth-authorize", endpoint=oauth_authorize),
     Route("/confirm/{token}", endpoint=confirm_email_handler),
-    Route("/upload", endpoint=upload_handler, methods=['POST'])
+    Route("/upload", endpoint=upload_handler, methods=['POST']),
+    Route("/topics", endpoint=topics_handler)
 ]
 
 app = Starlette(
@@ -84,6 +105,7 @@ app = Starlette(
 app.mount("/", GraphQL(
     schema,
     debug=True,
+    context_value=context_value,
     websocket_handler=GraphQLTransportWSHandler(
         on_connect=on_connect,
         on_disconnect=on_disconnect
@@ -100,6 +122,7 @@ dev_app = app = Starlette(
 dev_app.mount("/", GraphQL(
     schema,
     debug=True,
+    context_value=context_value,
     websocket_handler=GraphQLTransportWSHandler(
         on_connect=on_connect,
         on_disconnect=on_disconnect
@@ -1,7 +1,7 @@
 from datetime import datetime
 from enum import Enum as Enumeration
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, String
+from sqlalchemy import Column, DateTime, Enum, ForeignKey, Index, String
 
 from base.orm import Base
 
@@ -26,6 +26,11 @@ class ReactionKind(Enumeration):
 
 class Reaction(Base):
     __tablename__ = "reaction"
+    __table_args__ = (
+        # keyset pagination
+        Index("ix_reaction_created_at_id", "createdAt", "id"),
+        {"extend_existing": True}
+    )
     body = Column(String, nullable=True, comment="Reaction Body")
     createdAt = Column(
         DateTime, nullable=False, default=datetime.now, comment="Created at"
@@ -1,7 +1,8 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, JSON
-from sqlalchemy.orm import column_property, relationship
+from sqlalchemy import Boolean, Column, Computed, DateTime, ForeignKey, Index, Integer, String, JSON
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import column_property, deferred, relationship
 
 from base.orm import Base, local_session
 from orm.reaction import Reaction
@@ -9,6 +10,15 @@ from orm.topic import Topic
 from orm.user import User
 
 
+# russian config stems latin words with english_stem too
+SEARCH_CONFIG = "CASE WHEN lang = 'en' THEN 'english'::regconfig ELSE 'russian'::regconfig END"
+SEARCH_VECTOR = (
+    f"setweight(to_tsvector({SEARCH_CONFIG}, coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector({SEARCH_CONFIG}, coalesce(subtitle, '') || ' ' || coalesce(lead, '')), 'B') || "
+    f"setweight(to_tsvector({SEARCH_CONFIG}, coalesce(body, '')), 'D')"
+)
+
+
 class ShoutTopic(Base):
     __tablename__ = "shout_topic"
 
@@ -39,8 +49,27 @@ class ShoutAuthor(Base):
     caption = Column(String, nullable=True, default="")
 
 
+class ShoutStat(Base):
+    __tablename__ = "shout_stat"
+
+    id = None  # type: ignore
+    shout = Column(ForeignKey("shout.id"), primary_key=True, index=True)
+    reacted = Column(Integer, nullable=False, default=0)
+    commented = Column(Integer, nullable=False, default=0)
+    rating = Column(Integer, nullable=False, default=0)
+    lastComment = Column(DateTime, nullable=True, comment="Last comment at")
+
+
 class Shout(Base):
     __tablename__ = "shout"
+    __table_args__ = (
+        # keyset pagination
+        Index("ix_shout_published_at_id", "publishedAt", "id"),
+        Index("ix_shout_created_at_id", "createdAt", "id"),
+        # full-text search
+        Index("ix_shout_search_vector", "searchVector", postgresql_using="gin"),
+        {"extend_existing": True}
+    )
 
     # timestamps
     createdAt = Column(DateTime, nullable=False, default=datetime.now, comment="Created at")
@@ -73,6 +102,8 @@ class Shout(Base):
     # TODO: these field should be used or modified
     community = Column(ForeignKey("community.id"), default=1)
     lang = Column(String, nullable=False, default='ru', comment="Language")
+    # maintained by postgres on every insert and update, never loaded with the shout
+    searchVector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR, persisted=True)))
     mainTopic = Column(ForeignKey("topic.slug"), nullable=True)
     visibility = Column(String, nullable=True)  # owner authors community public
     versionOf = Column(ForeignKey("shout.id"), nullable=True)
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String
 
 from base.orm import Base
 
@@ -17,6 +17,16 @@ class TopicFollower(Base):
     auto = Column(Boolean, nullable=False, default=False)
 
 
+class TopicStat(Base):
+    __tablename__ = "topic_stat"
+
+    id = None  # type: ignore
+    topic = Column(ForeignKey("topic.id"), primary_key=True)
+    shouts = Column(Integer, nullable=False, default=0)
+    authors = Column(Integer, nullable=False, default=0)
+    followers = Column(Integer, nullable=False, default=0)
+
+
 class Topic(Base):
     __tablename__ = "topic"
 
@@ -40,6 +40,18 @@ class AuthorFollower(Base):
     auto = Column(Boolean, nullable=False, default=False)
 
 
+class AuthorStat(Base):
+    __tablename__ = "author_stat"
+
+    id = None  # type: ignore
+    author = Column(ForeignKey("user.id"), primary_key=True)
+    shouts = Column(Integer, nullable=False, default=0)
+    followers = Column(Integer, nullable=False, default=0)
+    followings = Column(Integer, nullable=False, default=0)
+    rating = Column(Integer, nullable=False, default=0)
+    commented = Column(Integer, nullable=False, default=0)
+
+
 class User(Base):
     __tablename__ = "user"
     default_user = None
@@ -42,7 +42,8 @@ from resolvers.zine.following import (
 
 from resolvers.zine.load import (
     load_shout,
-    load_shouts_by
+    load_shouts_by,
+    search_shouts
 )
 
 from resolvers.inbox.chats import (
@@ -82,6 +83,7 @@ __all__ = [
     # zine.load
     "load_shout",
     "load_shouts_by",
+    "search_shouts",
     # zine.following
     "follow",
     "unfollow",
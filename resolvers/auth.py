@@ -47,7 +47,8 @@ async def confirm_email(_, info, token):
         print('[resolvers.auth] confirm email by token')
         payload = JWTCodec.decode(token)
         user_id = payload.user_id
-        await TokenStorage.get(f"{user_id}-{payload.username}-{token}")
+        if not await TokenStorage.exist(payload, token):
+            raise InvalidToken("token is expired or revoked")
         with local_session() as session:
             user = session.query(User).where(User.id == user_id).first()
             session_token = await TokenStorage.create_session(user)
@@ -128,7 +129,7 @@ async def register_by_email(_, _info, email: str, password: str = "", name: str
             "slug": slug
         }
         if password:
-            user_dict["password"] = Password.encode(password)
+            user_dict["password"] = await Password.encode_async(password)
         user = create_user(user_dict)
         user = await auth_send_link(_, _info, email)
         return {"user": user}
@@ -172,7 +173,7 @@ async def login(_, info, email: str, password: str = "", lang: str = "ru"):
                 return {"error": "please, confirm email"}
             else:
                 try:
-                    user = Identity.password(orm_user, password)
+                    user = await Identity.password(orm_user, password)
                     session_token = await TokenStorage.create_session(user)
                     print(f"[auth] user {email} authorized")
                     return {
@@ -10,6 +10,12 @@ from base.resolvers import mutation
 from orm.shout import Shout, ShoutAuthor, ShoutTopic
 from orm.topic import Topic
 from resolvers.zine.reactions import reactions_follow, reactions_unfollow
+from services.following import FollowingManager, FollowingResult, shout_keys
+from services.search import SearchService
+from services.stat.authorstat import AuthorStatStorage
+from services.stat.topicstat import TopicStatStorage
+from services.zine.topicscache import TopicsCache
+from services.zine.feed import FeedStorage
 
 
 @mutation.field("createShout")
@@ -41,6 +47,8 @@ async def create_shout(_, info, inp):
         # NOTE: shout made by one first author
         sa = ShoutAuthor.create(shout=new_shout.id, user=auth.user_id)
         session.add(sa)
+        AuthorStatStorage.update(session, auth.user_id, shouts=1)
+        TopicStatStorage.refresh(session, [topic.id for topic in topics])
 
         session.add(new_shout)
 
@@ -55,6 +63,10 @@ async def create_shout(_, info, inp):
             new_shout.slug = f"draft-{new_shout.id}"
             session.commit()
 
+    await SearchService.update(new_shout)
+    if topics:
+        await TopicsCache.invalidate()
+
     return {"shout": new_shout}
 
 
@@ -76,6 +88,8 @@ async def update_shout(_, info, shout_id, shout_input=None, publish=False):
             return {"error": "access denied"}
 
         updated = False
+        published = False
+        relinked_topic_ids = []
 
         if shout_input is not None:
             topics_input = shout_input["topics"]
@@ -118,6 +132,12 @@ async def update_shout(_, info, shout_id, shout_input=None, publish=False):
             for shout_topic_to_remove in shout_topics_to_remove:
                 session.delete(shout_topic_to_remove)
 
+            relinked_topic_ids = [topic.id for topic in new_topics_to_link] + \
+                existing_topic_to_link_ids + topic_to_unlink_ids
+            if relinked_topic_ids:
+                session.flush()
+                TopicStatStorage.refresh(session, relinked_topic_ids)
+
             shout_input["mainTopic"] = shout_input["mainTopic"]["slug"]
 
             if shout_input["mainTopic"] == '':
@@ -130,13 +150,30 @@ async def update_shout(_, info, shout_id, shout_input=None, publish=False):
             shout.visibility = "community"
             shout.publishedAt = datetime.now(tz=timezone.utc)
             updated = True
+            published = True
 
         if updated:
             shout.updatedAt = datetime.now(tz=timezone.utc)
 
         session.commit()
+
+        if published:
+            # taken while the session is open, topics could have been relinked above
+            payload = shout.dict()
+            author_ids = [author.id for author in shout.authors]
+            topic_ids = [topic_id for [topic_id] in session.query(ShoutTopic.topic).where(ShoutTopic.shout == shout.id)]
     # GitTask(inp, user.username, user.email, "update shout %s" % slug)
 
+    if published:
+        await FeedStorage.fanout(shout.id)
+        result = FollowingResult("NEW", 'shout', payload)
+        # one push for both, a subscriber following an author and a topic of the shout gets it once
+        await FollowingManager.push('shout', result, shout_keys(author_ids, topic_ids))
+    if updated:
+        await SearchService.update(shout)
+    if relinked_topic_ids:
+        await TopicsCache.invalidate()
+
     return {"shout": shout}
 
 
@@ -157,7 +194,16 @@ async def delete_shout(_, info, shout_id):
         for author_id in shout.authors:
             reactions_unfollow(author_id, shout_id)
 
+        if shout.deletedAt is None:
+            for author in shout.authors:
+                AuthorStatStorage.update(session, author.id, shouts=-1)
+
         shout.deletedAt = datetime.now(tz=timezone.utc)
+        session.flush()
+        TopicStatStorage.refresh(session, [topic.id for topic in shout.topics])
         session.commit()
 
+    await SearchService.update(shout)
+    await TopicsCache.invalidate()
+
     return {}
@@ -1,11 +1,12 @@
 
 from base.resolvers import query
 from resolvers.auth import login_required
-from migration.extract import extract_md
 
 
 @login_required
 @query.field("markdownBody")
 def markdown_body(_, info, body: str):
+    # the migration package brings bs4 and all the table migrators along
+    from migration.extract import extract_md
     body = extract_md(body)
     return body
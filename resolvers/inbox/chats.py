@@ -6,6 +6,7 @@ from auth.authenticate import login_required
 from auth.credentials import AuthCredentials
 from base.redis import redis
 from base.resolvers import mutation
+from services.inbox.storage import MessageStorage
 from validations.inbox import Chat
 
 
@@ -38,8 +39,7 @@ async def update_chat(_, info, chat_new: Chat):
             "admins": chat_new.get("admins", chat.get("admins") or []),
             "users": chat_new.get("users", chat["users"])
         })
-    await redis.execute("SET", f"chats/{chat.id}", json.dumps(chat))
-    await redis.execute("COMMIT")
+    await redis.execute("SET", f"chats/{chat_id}", json.dumps(chat))
 
     return {
         "error": None,
@@ -60,24 +60,16 @@ async def create_chat(_, info, title="", members=[]):
     if len(members) == 2 and title == "":
         chat = None
         print(members)
-        chatset1 = await redis.execute("SMEMBERS", f"chats_by_user/{members[0]}")
-        if not chatset1:
-            chatset1 = set([])
-        print(chatset1)
-        chatset2 = await redis.execute("SMEMBERS", f"chats_by_user/{members[1]}")
-        if not chatset2:
-            chatset2 = set([])
-        print(chatset2)
-        chatset = chatset1.intersection(chatset2)
+        chatset = await redis.execute(
+            "SINTER", f"chats_by_user/{members[0]}", f"chats_by_user/{members[1]}"
+        ) or set([])
         print(chatset)
-        for c in chatset:
-            chat = await redis.execute("GET", f"chats/{c.decode('utf-8')}")
-            if chat:
-                chat = json.loads(chat)
-                if chat['title'] == "":
-                    print('[inbox] createChat found old chat')
-                    print(chat)
-                    break
+        for c in await redis.mget_json([f"chats/{c.decode('utf-8')}" for c in chatset]):
+            if c and c['title'] == "":
+                print('[inbox] createChat found old chat')
+                print(c)
+                chat = c
+                break
         if chat:
             return {
                 "chat": chat,
@@ -95,11 +87,10 @@ async def create_chat(_, info, title="", members=[]):
         "admins": members if (len(members) == 2 and title == "") else []
     }
 
-    for m in members:
-        await redis.execute("SADD", f"chats_by_user/{m}", chat_id)
-    await redis.execute("SET", f"chats/{chat_id}", json.dumps(chat))
-    await redis.execute("SET", f"chats/{chat_id}/next_message_id", str(0))
-    await redis.execute("COMMIT")
+    async with redis.transaction() as tr:
+        tr.sadd_many([f"chats_by_user/{m}" for m in members], chat_id)
+        tr.execute("SET", f"chats/{chat_id}", json.dumps(chat))
+        tr.execute("SET", f"chats/{chat_id}/next_message_id", str(0))
     return {
         "error": None,
         "chat": chat
@@ -111,13 +102,11 @@ async def create_chat(_, info, title="", members=[]):
 async def delete_chat(_, info, chat_id: str):
     auth: AuthCredentials = info.context["request"].auth
 
-    chat = await redis.execute("GET", f"/chats/{chat_id}")
+    chat = await redis.execute("GET", f"chats/{chat_id}")
     if chat:
         chat = dict(json.loads(chat))
         if auth.user_id in chat['admins']:
-            await redis.execute("DEL", f"chats/{chat_id}")
-            await redis.execute("SREM", "chats_by_user/" + str(auth.user_id), chat_id)
-            await redis.execute("COMMIT")
+            await MessageStorage.drop(chat_id)
     else:
         return {
             "error": "chat not exist"
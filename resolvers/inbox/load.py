@@ -1,48 +1,51 @@
-import json
+import asyncio
 # from datetime import datetime, timedelta, timezone
 
 from auth.authenticate import login_required
 from auth.credentials import AuthCredentials
+from base.dataloader import loader
 from base.redis import redis
 from base.orm import local_session
 from base.resolvers import query
 from orm.user import User
 from resolvers.zine.profile import followed_authors
-from .unread import get_unread_counter
+from services.inbox.storage import MessageStorage
 
 
 async def load_messages(chat_id: str, limit: int = 5, offset: int = 0, ids=[]):
     ''' load :limit messages for :chat_id with :offset '''
     messages = []
-    message_ids = []
-    if ids:
-        message_ids += ids
     try:
+        if ids:
+            messages += await MessageStorage.get_many(chat_id, ids)
         if limit:
-            mids = await redis.lrange(f"chats/{chat_id}/message_ids",
-                                      offset,
-                                      offset + limit
-                                      )
-            mids = [mid.decode("utf-8") for mid in mids]
-            message_ids += mids
+            [last] = await MessageStorage.last([chat_id], limit, offset)
+            messages += last
     except Exception as e:
         print(e)
-    if message_ids:
-        message_keys = [f"chats/{chat_id}/messages/{mid}" for mid in message_ids]
-        messages = await redis.mget(*message_keys)
-        messages = [json.loads(msg.decode('utf-8')) for msg in messages]
-        replies = []
-        for m in messages:
-            rt = m.get('replyTo')
-            if rt:
-                rt = int(rt)
-                if rt not in message_ids:
-                    replies.append(rt)
-        if replies:
-            messages += await load_messages(chat_id, limit=0, ids=replies)
+    loaded = set(m['id'] for m in messages)
+    replies = set()
+    for m in messages:
+        rt = m.get('replyTo')
+        if rt and int(rt) not in loaded:
+            replies.add(int(rt))
+    if replies:
+        messages += await MessageStorage.get_many(chat_id, list(replies))
     return messages
 
 
+@loader("last_messages")
+async def load_last_messages(chat_ids, limit=5):
+    """ the same as load_messages(chat_id, limit) for every chat, in a few round trips """
+    by_chat = await MessageStorage.last(chat_ids, limit)
+    for chat_id, messages in zip(chat_ids, by_chat):
+        loaded = set(m['id'] for m in messages)
+        replies = set(int(m['replyTo']) for m in messages if m.get('replyTo'))
+        if replies - loaded:
+            messages += await MessageStorage.get_many(chat_id, list(replies - loaded))
+    return by_chat
+
+
 @query.field("loadChats")
 @login_required
 async def load_chats(_, info, limit: int = 50, offset: int = 0):
@@ -56,32 +59,34 @@ async def load_chats(_, info, limit: int = 50, offset: int = 0):
         print('[inbox.load] no chats were found')
         cids = []
     onliners = await redis.execute("SMEMBERS", "users-online")
-    if not onliners:
-        onliners = []
-    chats = []
-    for cid in cids:
-        cid = cid.decode("utf-8")
-        c = await redis.execute("GET", "chats/" + cid)
-        if c:
-            c = dict(json.loads(c))
-            c['messages'] = await load_messages(cid, 5, 0)
-            c['unread'] = await get_unread_counter(cid, auth.user_id)
-            with local_session() as session:
-                c['members'] = []
-                for uid in c["users"]:
-                    a = session.query(User).where(User.id == uid).first()
-                    if a:
-                        c['members'].append({
-                            "id": a.id,
-                            "slug": a.slug,
-                            "userpic": a.userpic,
-                            "name": a.name,
-                            "lastSeen": a.lastSeen,
-                            "online": a.id in onliners
-                        })
-                chats.append(c)
+    onliners = set(int(uid) for uid in onliners or [])
+    loaders = info.context["loaders"]
+
+    async def load_chat(c):
+        c['messages'], c['unread'], members = await asyncio.gather(
+            loaders["last_messages"].load(c['id']),
+            loaders["unread"].load((c['id'], auth.user_id)),
+            loaders["user"].load_many(c["users"])
+        )
+        c['members'] = []
+        for a in members:
+            if a:
+                c['members'].append({
+                    "id": a.id,
+                    "slug": a.slug,
+                    "userpic": a.userpic,
+                    "name": a.name,
+                    "lastSeen": a.lastSeen,
+                    "online": a.id in onliners
+                })
+        return c
+
+    cids = [cid.decode("utf-8") for cid in cids]
+    chats = [c for c in await redis.mget_json(["chats/" + cid for cid in cids]) if c]
+    # every chat is loaded concurrently, so the loaders batch them together
+    chats = await asyncio.gather(*[load_chat(c) for c in chats])
     return {
-        "chats": chats,
+        "chats": list(chats),
         "error": None
     }
 
@@ -1,4 +1,3 @@
-import asyncio
 import json
 from typing import Any
 from datetime import datetime, timezone
@@ -8,6 +7,8 @@ from auth.credentials import AuthCredentials
 from base.redis import redis
 from base.resolvers import mutation, subscription
 from services.following import FollowingManager, FollowingResult, Following
+from services.inbox.storage import MessageStorage
+from services.inbox.stream import InboxStream, parse_id
 from validations.inbox import Message
 
 
@@ -17,41 +18,24 @@ async def create_message(_, info, chat: str, body: str, replyTo=None):
     """ create message with :body for :chat_id replying to :replyTo optionally """
     auth: AuthCredentials = info.context["request"].auth
 
-    chat = await redis.execute("GET", f"chats/{chat}")
-    if not chat:
+    new_message = {
+        "chatId": chat,
+        "author": auth.user_id,
+        "body": body,
+        "createdAt": int(datetime.now(tz=timezone.utc).timestamp())
+    }
+    if replyTo:
+        new_message['replyTo'] = replyTo
+    print(f"[inbox] creating message {new_message}")
+    # message id is allocated atomically by the script
+    new_message, users = await MessageStorage.create(chat, new_message)
+    if not new_message:
         return {
             "error": "chat is not exist"
         }
     else:
-        chat = dict(json.loads(chat))
-        message_id = await redis.execute("GET", f"chats/{chat['id']}/next_message_id")
-        message_id = int(message_id)
-        new_message = {
-            "chatId": chat['id'],
-            "id": message_id,
-            "author": auth.user_id,
-            "body": body,
-            "createdAt": int(datetime.now(tz=timezone.utc).timestamp())
-        }
-        if replyTo:
-            new_message['replyTo'] = replyTo
-        chat['updatedAt'] = new_message['createdAt']
-        await redis.execute("SET", f"chats/{chat['id']}", json.dumps(chat))
-        print(f"[inbox] creating message {new_message}")
-        await redis.execute(
-            "SET", f"chats/{chat['id']}/messages/{message_id}", json.dumps(new_message)
-        )
-        await redis.execute("LPUSH", f"chats/{chat['id']}/message_ids", str(message_id))
-        await redis.execute("SET", f"chats/{chat['id']}/next_message_id", str(message_id + 1))
-
-        users = chat["users"]
-        for user_slug in users:
-            await redis.execute(
-                "LPUSH", f"chats/{chat['id']}/unread/{user_slug}", str(message_id)
-            )
-
         result = FollowingResult("NEW", 'chat', new_message)
-        await FollowingManager.push('chat', result)
+        await InboxStream.add(users, result)
 
         return {
             "message": new_message,
@@ -67,22 +51,22 @@ async def update_message(_, info, chat_id: str, message_id: int, body: str):
     chat = await redis.execute("GET", f"chats/{chat_id}")
     if not chat:
         return {"error": "chat not exist"}
+    chat = json.loads(chat)
 
-    message = await redis.execute("GET", f"chats/{chat_id}/messages/{message_id}")
+    message = await MessageStorage.get(chat_id, message_id)
     if not message:
         return {"error": "message  not exist"}
 
-    message = json.loads(message)
     if message["author"] != auth.user_id:
         return {"error": "access denied"}
 
     message["body"] = body
     message["updatedAt"] = int(datetime.now(tz=timezone.utc).timestamp())
 
-    await redis.execute("SET", f"chats/{chat_id}/messages/{message_id}", json.dumps(message))
+    await MessageStorage.update(chat_id, message)
 
     result = FollowingResult("UPDATED", 'chat', message)
-    await FollowingManager.push('chat', result)
+    await InboxStream.add(chat["users"], result)
 
     return {
         "message": message,
@@ -100,22 +84,16 @@ async def delete_message(_, info, chat_id: str, message_id: int):
         return {"error": "chat not exist"}
     chat = json.loads(chat)
 
-    message = await redis.execute("GET", f"chats/{chat_id}/messages/{str(message_id)}")
+    message = await MessageStorage.get(chat_id, message_id)
     if not message:
         return {"error": "message  not exist"}
-    message = json.loads(message)
     if message["author"] != auth.user_id:
         return {"error": "access denied"}
 
-    await redis.execute("LREM", f"chats/{chat_id}/message_ids", 0, str(message_id))
-    await redis.execute("DEL", f"chats/{chat_id}/messages/{str(message_id)}")
-
-    users = chat["users"]
-    for user_id in users:
-        await redis.execute("LREM", f"chats/{chat_id}/unread/{user_id}", 0, str(message_id))
+    await MessageStorage.delete(chat_id, message_id)
 
     result = FollowingResult("DELETED", 'chat', message)
-    await FollowingManager.push(result)
+    await InboxStream.add(chat["users"], result)
 
     return {}
 
@@ -134,8 +112,7 @@ async def mark_as_read(_, info, chat_id: str, messages: [int]):
     if auth.user_id not in users:
         return {"error": "access denied"}
 
-    for message_id in messages:
-        await redis.execute("LREM", f"chats/{chat_id}/unread/{auth.user_id}", 0, str(message_id))
+    await MessageStorage.mark_read(chat_id, auth.user_id, messages)
 
     return {
         "error": None
@@ -143,34 +120,31 @@ async def mark_as_read(_, info, chat_id: str, messages: [int]):
 
 
 @subscription.source("newMessage")
-async def message_generator(_, info: GraphQLResolveInfo):
+async def message_generator(_, info: GraphQLResolveInfo, after: str = None):
+    """ events of all the user's chats, the ones after :after stream id are replayed first """
     print(f"[resolvers.messages] generator {info}")
     auth: AuthCredentials = info.context["request"].auth
     user_id = auth.user_id
+    # one queue for the user's inbox, chats joined later are included
+    inbox = Following('inbox', user_id)
     try:
-        user_following_chats = await redis.execute("GET", f"chats_by_user/{user_id}")
-        if user_following_chats:
-            user_following_chats = list(json.loads(user_following_chats))  # chat ids
-        else:
-            user_following_chats = []
-        tasks = []
-        updated = {}
-        for chat_id in user_following_chats:
-            chat = await redis.execute("GET", f"chats/{chat_id}")
-            updated[chat_id] = chat['updatedAt']
-        user_following_chats_sorted = sorted(user_following_chats, key=lambda x: updated[x], reverse=True)
-
-        for chat_id in user_following_chats_sorted:
-            following_chat = Following('chat', chat_id)
-            await FollowingManager.register('chat', following_chat)
-            chat_task = following_chat.queue.get()
-            tasks.append(chat_task)
+        # registered before replaying so nothing is missed in between
+        await FollowingManager.register('inbox', inbox)
+        replayed_id = None
+        if after:
+            replayed_id = parse_id(after)
+            for result in await InboxStream.replay(user_id, after):
+                replayed_id = parse_id(result.payload["streamId"])
+                yield result.payload
 
         while True:
-            msg = await asyncio.gather(*tasks)
-            yield msg
+            payload = InboxStream.payload_for(await inbox.get(), user_id)
+            # live events come in the publishing order, not always in the stream order
+            if replayed_id and parse_id(payload["streamId"]) <= replayed_id:
+                continue  # already replayed
+            yield payload
     finally:
-        await FollowingManager.remove('chat', following_chat)
+        await FollowingManager.remove('inbox', inbox)
 
 
 @subscription.field("newMessage")
@@ -2,8 +2,6 @@ import os
 import shutil
 import tempfile
 import uuid
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
 from starlette.responses import JSONResponse
 
 STORJ_ACCESS_KEY = os.environ.get('STORJ_ACCESS_KEY')
@@ -12,6 +10,21 @@ STORJ_END_POINT = os.environ.get('STORJ_END_POINT')
 STORJ_BUCKET_NAME = os.environ.get('STORJ_BUCKET_NAME')
 CDN_DOMAIN = os.environ.get('CDN_DOMAIN')
 
+_s3 = None
+
+
+def get_s3():
+    """ boto3 takes a while to import, so the client is made on the first upload """
+    global _s3
+    if _s3 is None:
+        import boto3
+        # Create an S3 client with Storj configuration
+        _s3 = boto3.client('s3',
+                           aws_access_key_id=STORJ_ACCESS_KEY,
+                           aws_secret_access_key=STORJ_SECRET_KEY,
+                           endpoint_url=STORJ_END_POINT)
+    return _s3
+
 
 async def upload_handler(request):
     form = await request.form()
@@ -24,11 +37,8 @@ async def upload_handler(request):
 
     key = str(uuid.uuid4()) + file_extension
 
-    # Create an S3 client with Storj configuration
-    s3 = boto3.client('s3',
-                      aws_access_key_id=STORJ_ACCESS_KEY,
-                      aws_secret_access_key=STORJ_SECRET_KEY,
-                      endpoint_url=STORJ_END_POINT)
+    s3 = get_s3()
+    from botocore.exceptions import BotoCoreError, ClientError
 
     try:
         # Save the uploaded file to a temporary file
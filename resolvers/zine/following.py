@@ -1,4 +1,3 @@
-import asyncio
 from base.orm import local_session
 from base.resolvers import mutation, subscription
 from auth.authenticate import login_required
@@ -10,7 +9,9 @@ from orm.shout import ShoutReactionsFollower
 from resolvers.zine.profile import author_follow, author_unfollow
 from resolvers.zine.reactions import reactions_follow, reactions_unfollow
 from resolvers.zine.topics import topic_follow, topic_unfollow
-from services.following import Following, FollowingManager, FollowingResult
+from services.following import COALESCE, Following, FollowingManager, FollowingResult, shout_keys
+from services.zine.feed import FeedStorage
+from services.zine.topicscache import TopicsCache
 from graphql.type import GraphQLResolveInfo
 
 
@@ -21,21 +22,27 @@ async def follow(_, info, what, slug):
 
     try:
         if what == "AUTHOR":
-            if author_follow(auth.user_id, slug):
+            author_id = author_follow(auth.user_id, slug)
+            if author_id:
+                await FeedStorage.follow_author(auth.user_id, slug)
                 result = FollowingResult("NEW", 'author', slug)
-                await FollowingManager.push('author', result)
+                await FollowingManager.push('author', result, [author_id])
         elif what == "TOPIC":
-            if topic_follow(auth.user_id, slug):
+            topic_id = topic_follow(auth.user_id, slug)
+            if topic_id:
+                await FeedStorage.follow_topic(auth.user_id, slug)
+                await TopicsCache.followed(topic_id, 1)
                 result = FollowingResult("NEW", 'topic', slug)
-                await FollowingManager.push('topic', result)
+                await FollowingManager.push('topic', result, [topic_id])
         elif what == "COMMUNITY":
             if False:  # TODO: use community_follow(auth.user_id, slug):
                 result = FollowingResult("NEW", 'community', slug)
                 await FollowingManager.push('community', result)
         elif what == "REACTIONS":
-            if reactions_follow(auth.user_id, slug):
+            shout_id = reactions_follow(auth.user_id, slug)
+            if shout_id:
                 result = FollowingResult("NEW", 'shout', slug)
-                await FollowingManager.push('shout', result)
+                await FollowingManager.push('shout', result, [shout_id])
     except Exception as e:
         print(Exception(e))
         return {"error": str(e)}
@@ -50,21 +57,27 @@ async def unfollow(_, info, what, slug):
 
     try:
         if what == "AUTHOR":
-            if author_unfollow(auth.user_id, slug):
+            author_id = author_unfollow(auth.user_id, slug)
+            if author_id:
+                await FeedStorage.forget(auth.user_id)
                 result = FollowingResult("DELETED", 'author', slug)
-                await FollowingManager.push('author', result)
+                await FollowingManager.push('author', result, [author_id])
         elif what == "TOPIC":
-            if topic_unfollow(auth.user_id, slug):
+            topic_id = topic_unfollow(auth.user_id, slug)
+            if topic_id:
+                await FeedStorage.forget(auth.user_id)
+                await TopicsCache.followed(topic_id, -1)
                 result = FollowingResult("DELETED", 'topic', slug)
-                await FollowingManager.push('topic', result)
+                await FollowingManager.push('topic', result, [topic_id])
         elif what == "COMMUNITY":
             if False:  # TODO: use community_unfollow(auth.user_id, slug):
                 result = FollowingResult("DELETED", 'community', slug)
                 await FollowingManager.push('community', result)
         elif what == "REACTIONS":
-            if reactions_unfollow(auth.user_id, slug):
+            shout_id = reactions_unfollow(auth.user_id, slug)
+            if shout_id:
                 result = FollowingResult("DELETED", 'shout', slug)
-                await FollowingManager.push('shout', result)
+                await FollowingManager.push('shout', result, [shout_id])
     except Exception as e:
         return {"error": str(e)}
 
@@ -78,46 +91,28 @@ async def shout_generator(_, info: GraphQLResolveInfo):
     print(f"[resolvers.zine] shouts generator {info}")
     auth: AuthCredentials = info.context["request"].auth
     user_id = auth.user_id
+    # a shout by a followed author in a followed topic comes once
+    following_shouts = Following('shout', user_id, policy=COALESCE)
     try:
-        tasks = []
-
         with local_session() as session:
+            # notify new shout by followed topics
+            topic_ids = session.query(TopicFollower.topic).where(TopicFollower.follower == user_id).all()
+            # by followed authors
+            author_ids = session.query(AuthorFollower.author).where(AuthorFollower.follower == user_id).all()
 
-            # notify new shout by followed authors
-            following_topics = session.query(TopicFollower).where(TopicFollower.follower == user_id).all()
-
-            for topic_id in following_topics:
-                following_topic = Following('topic', topic_id)
-                await FollowingManager.register('topic', following_topic)
-                following_topic_task = following_topic.queue.get()
-                tasks.append(following_topic_task)
-
-            # by followed topics
-            following_authors = session.query(AuthorFollower).where(
-                AuthorFollower.follower == user_id).all()
-
-            for author_id in following_authors:
-                following_author = Following('author', author_id)
-                await FollowingManager.register('author', following_author)
-                following_author_task = following_author.queue.get()
-                tasks.append(following_author_task)
+        await FollowingManager.register('shout', following_shouts, shout_keys(
+            [author_id for [author_id] in author_ids],
+            [topic_id for [topic_id] in topic_ids]
+        ))
 
-            # TODO: use communities
-            # by followed communities
-            # following_communities = session.query(CommunityFollower).where(
-            #    CommunityFollower.follower == user_id).all()
-
-            # for community_id in following_communities:
-            #     following_community = Following('community', author_id)
-            #     await FollowingManager.register('community', following_community)
-            #     following_community_task = following_community.queue.get()
-            #     tasks.append(following_community_task)
+        # TODO: use communities
+        # by followed communities
 
         while True:
-            shout = await asyncio.gather(*tasks)
-            yield shout
+            result = await following_shouts.get()
+            yield result.payload
     finally:
-        pass
+        await FollowingManager.remove('shout', following_shouts)
 
 
 @subscription.source("newReaction")
@@ -126,22 +121,19 @@ async def reaction_generator(_, info):
     print(f"[resolvers.zine] reactions generator {info}")
     auth: AuthCredentials = info.context["request"].auth
     user_id = auth.user_id
+    following_reactions = Following('shout', user_id)
     try:
         with local_session() as session:
-            followings = session.query(ShoutReactionsFollower.shout).where(
-                ShoutReactionsFollower.follower == user_id).unique()
-
-            # notify new reaction
+            shout_ids = session.query(ShoutReactionsFollower.shout).where(
+                ShoutReactionsFollower.follower == user_id).all()
 
-            tasks = []
-            for shout_id in followings:
-                following_shout = Following('shout', shout_id)
-                await FollowingManager.register('shout', following_shout)
-                following_author_task = following_shout.queue.get()
-                tasks.append(following_author_task)
+        # notify new reaction
+        await FollowingManager.register('shout', following_reactions, [shout_id for [shout_id] in shout_ids])
 
-            while True:
-                reaction = await asyncio.gather(*tasks)
-                yield reaction
+        while True:
+            result = await following_reactions.get()
+            # followers of the shout are notified with the same key
+            if result.kind == 'reaction':
+                yield result.payload
     finally:
-        pass
+        await FollowingManager.remove('shout', following_reactions)
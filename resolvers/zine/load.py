@@ -1,49 +1,81 @@
+import asyncio
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime, timedelta, timezone
 
-from sqlalchemy.orm import joinedload, aliased
-from sqlalchemy.sql.expression import desc, asc, select, func, case, and_, text, nulls_last
+from graphql import default_field_resolver
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql.expression import desc, asc, select, func, and_, nulls_last, tuple_
 
 from auth.authenticate import login_required
 from auth.credentials import AuthCredentials
 from base.exceptions import ObjectNotExist, OperationNotAllowed
-from base.orm import local_session
-from base.resolvers import query
-from orm import TopicFollower
-from orm.reaction import Reaction, ReactionKind
-from orm.shout import Shout, ShoutAuthor, ShoutTopic
-from orm.user import AuthorFollower
+from base.orm import async_session
+from base.resolvers import query, shout_type
+from orm.reaction import Reaction
+from orm.shout import Shout, ShoutStat
+from services.search import SearchService, search_filter
+from services.zine.feed import FeedStorage
+
+
+# keyset pagination works for these ordering fields only
+CURSOR_FIELDS = ("publishedAt", "createdAt")
+
+
+def encode_cursor(value, entity_id):
+    """ opaque cursor pointing right after the entity """
+    cursor = json.dumps([value.isoformat() if value else None, entity_id])
+    return urlsafe_b64encode(cursor.encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor):
+    value, entity_id = json.loads(urlsafe_b64decode(cursor.encode("utf-8")))
+    if value is None:
+        raise ValueError("Cursor points to an entity without ordering value")
+    return datetime.fromisoformat(value), int(entity_id)
+
+
+def keyset_filter(column, id_column, cursor, descending=True):
+    """ (column, id) after the cursor, served by a composite (column, id) index """
+    value, entity_id = decode_cursor(cursor)
+    key = tuple_(column, id_column)
+    bound = tuple_(value, entity_id)
+    return key < bound if descending else key > bound
+
+
+def apply_order(q, options):
+    """ offset pagination by default, keyset pagination with options.after cursor """
+    order_by = options.get("order_by") or "publishedAt"
+    order_way = desc if options.get('order_by_desc', True) else asc
+    offset = options.get("offset", 0)
+    limit = options.get("limit", 10)
+
+    if order_by not in CURSOR_FIELDS:
+        if options.get("after"):
+            raise ValueError("Cursor works only with order by %s" % " or ".join(CURSOR_FIELDS))
+        return q.order_by(nulls_last(order_way(order_by))).limit(limit).offset(offset)
+
+    column = getattr(Shout, order_by)
+    if options.get("after"):
+        q = q.where(keyset_filter(column, Shout.id, options["after"], order_way == desc))
+        return q.order_by(order_way(column), order_way(Shout.id)).limit(limit)
+
+    return q.order_by(nulls_last(order_way(column)), order_way(Shout.id)).limit(limit).offset(offset)
+
+
+def set_cursor(shout, options):
+    order_by = options.get("order_by") or "publishedAt"
+    if order_by in CURSOR_FIELDS:
+        shout.cursor = encode_cursor(getattr(shout, order_by), shout.id)
 
 
 def add_stat_columns(q):
-    aliased_reaction = aliased(Reaction)
-
-    q = q.outerjoin(aliased_reaction).add_columns(
-        func.sum(
-            aliased_reaction.id
-        ).label('reacted_stat'),
-        func.sum(
-            case(
-                (aliased_reaction.kind == ReactionKind.COMMENT, 1),
-                else_=0
-            )
-        ).label('commented_stat'),
-        func.sum(case(
-            # do not count comments' reactions
-            (aliased_reaction.replyTo.is_not(None), 0),
-            (aliased_reaction.kind == ReactionKind.AGREE, 1),
-            (aliased_reaction.kind == ReactionKind.DISAGREE, -1),
-            (aliased_reaction.kind == ReactionKind.PROOF, 1),
-            (aliased_reaction.kind == ReactionKind.DISPROOF, -1),
-            (aliased_reaction.kind == ReactionKind.ACCEPT, 1),
-            (aliased_reaction.kind == ReactionKind.REJECT, -1),
-            (aliased_reaction.kind == ReactionKind.LIKE, 1),
-            (aliased_reaction.kind == ReactionKind.DISLIKE, -1),
-            else_=0)
-        ).label('rating_stat'),
-        func.max(case(
-            (aliased_reaction.kind != ReactionKind.COMMENT, None),
-            else_=aliased_reaction.createdAt
-        )).label('last_comment'))
+    q = q.outerjoin(ShoutStat, ShoutStat.shout == Shout.id).add_columns(
+        func.coalesce(ShoutStat.reacted, 0).label('reacted_stat'),
+        func.coalesce(ShoutStat.commented, 0).label('commented_stat'),
+        func.coalesce(ShoutStat.rating, 0).label('rating_stat'),
+        ShoutStat.lastComment.label('last_comment')
+    )
 
     return q
 
@@ -67,7 +99,7 @@ def apply_filters(q, filters, user_id=None):
     if filters.get("title"):
         q = q.filter(Shout.title.ilike(f'%{filters.get("title")}%'))
     if filters.get("body"):
-        q = q.filter(Shout.body.ilike(f'%{filters.get("body")}%s'))
+        q = q.filter(search_filter(filters.get("body")))
     if filters.get("days"):
         before = datetime.now(tz=timezone.utc) - timedelta(days=int(filters.get("days")) or 30)
         q = q.filter(Shout.createdAt > before)
@@ -77,7 +109,7 @@ def apply_filters(q, filters, user_id=None):
 
 @query.field("loadShout")
 async def load_shout(_, info, slug=None, shout_id=None):
-    with local_session() as session:
+    async with async_session() as session:
         q = select(Shout).options(
             joinedload(Shout.authors),
             joinedload(Shout.topics),
@@ -96,10 +128,10 @@ async def load_shout(_, info, slug=None, shout_id=None):
 
         q = q.filter(
             Shout.deletedAt.is_(None)
-        ).group_by(Shout.id)
+        )
 
         try:
-            [shout, reacted_stat, commented_stat, rating_stat, last_comment] = session.execute(q).first()
+            [shout, reacted_stat, commented_stat, rating_stat, last_comment] = (await session.execute(q)).unique().first()
 
             shout.stat = {
                 "viewed": shout.views,
@@ -108,15 +140,24 @@ async def load_shout(_, info, slug=None, shout_id=None):
                 "rating": rating_stat
             }
 
-            for author_caption in session.query(ShoutAuthor).join(Shout).where(Shout.slug == slug):
-                for author in shout.authors:
-                    if author.id == author_caption.user:
-                        author.caption = author_caption.caption
+            shout.author_captions = await info.context["loaders"]["shout_captions"].load(shout.id)
             return shout
         except Exception:
             raise ObjectNotExist("Slug was not found: %s" % slug)
 
 
+@shout_type.field("authors")
+def resolve_shout_authors(shout, info):
+    """
+    an author of several shouts is one instance in the session,
+    so the captions stay on the shout and every author gets a plain copy with the own one
+    """
+    captions = getattr(shout, "author_captions", None)
+    if captions is None:
+        return default_field_resolver(shout, info)
+    return [dict(author.dict(), caption=captions.get(author.id)) for author in shout.authors]
+
+
 @query.field("loadShouts")
 async def load_shouts_by(_, info, options):
     """
@@ -127,12 +168,13 @@ async def load_shouts_by(_, info, options):
             author: 'discours',
             topic: 'culture',
             title: 'something',
-            body: 'something else',
+            body: 'something else',  # full-text search
             days: 30
         }
         offset: 0
+        after: 'cursor of the last shout on the previous page'
         limit: 50
-        order_by: 'createdAt' | 'commented' | 'reacted' | 'rating'
+        order_by: 'publishedAt' | 'createdAt' | 'commented' | 'reacted' | 'rating'
         order_by_desc: true
 
     }
@@ -151,19 +193,13 @@ async def load_shouts_by(_, info, options):
     auth: AuthCredentials = info.context["request"].auth
     q = apply_filters(q, options.get("filters", {}), auth.user_id)
 
-    order_by = options.get("order_by", Shout.publishedAt)
-
-    query_order_by = desc(order_by) if options.get('order_by_desc', True) else asc(order_by)
-    offset = options.get("offset", 0)
-    limit = options.get("limit", 10)
-
-    q = q.group_by(Shout.id).order_by(nulls_last(query_order_by)).limit(limit).offset(offset)
+    q = apply_order(q, options)
 
     shouts = []
-    with local_session() as session:
+    async with async_session() as session:
         shouts_map = {}
 
-        for [shout, reacted_stat, commented_stat, rating_stat, last_comment] in session.execute(q).unique():
+        for [shout, reacted_stat, commented_stat, rating_stat, last_comment] in (await session.execute(q)).unique():
             shouts.append(shout)
             shout.stat = {
                 "viewed": shout.views,
@@ -171,8 +207,31 @@ async def load_shouts_by(_, info, options):
                 "commented": commented_stat,
                 "rating": rating_stat
             }
+            set_cursor(shout, options)
             shouts_map[shout.id] = shout
 
+    if options.get("with_author_captions"):
+        captions = await info.context["loaders"]["shout_captions"].load_many(shouts_map.keys())
+        for shout, shout_captions in zip(shouts_map.values(), captions):
+            shout.author_captions = shout_captions
+
+    return shouts
+
+
+@query.field("searchShouts")
+async def search_shouts(_, info, text, limit=50, offset=0):
+    """ published shouts matching the text, the most relevant first """
+    hits = await SearchService.search(text, limit, offset)
+    ids = [hit["id"] for hit in hits]
+    loaders = info.context["loaders"]
+    found, stats = await asyncio.gather(loaders["shout"].load_many(ids), loaders["shout_stat"].load_many(ids))
+
+    shouts = []
+    for hit, shout, stat in zip(hits, found, stats):
+        if shout:
+            shout.snippet = hit["snippet"]
+            shout.stat = {"viewed": shout.views, **stat}
+            shouts.append(shout)
     return shouts
 
 
@@ -191,8 +250,8 @@ async def get_drafts(_, info):
     q = q.group_by(Shout.id)
 
     shouts = []
-    with local_session() as session:
-        for [shout] in session.execute(q).unique():
+    async with async_session() as session:
+        for [shout] in (await session.execute(q)).unique():
             shouts.append(shout)
 
     return shouts
@@ -201,18 +260,16 @@ async def get_drafts(_, info):
 @query.field("myFeed")
 @login_required
 async def get_my_feed(_, info, options):
+    """
+    newest first pages come right from the feed storage, any other filter or order
+    is applied to the newest FEED_SIZE shouts of the feed only
+    """
     auth: AuthCredentials = info.context["request"].auth
     user_id = auth.user_id
 
-    subquery = select(Shout.id).join(
-        ShoutAuthor
-    ).join(
-        AuthorFollower, AuthorFollower.follower == user_id
-    ).join(
-        ShoutTopic
-    ).join(
-        TopicFollower, TopicFollower.follower == user_id
-    )
+    filters = options.get("filters", {})
+    order_by = options.get("order_by") or "publishedAt"
+    newest_first = order_by == "publishedAt" and options.get("order_by_desc", True)
 
     q = select(Shout).options(
         joinedload(Shout.authors),
@@ -220,26 +277,27 @@ async def get_my_feed(_, info, options):
     ).where(
         and_(
             Shout.publishedAt.is_not(None),
-            Shout.deletedAt.is_(None),
-            Shout.id.in_(subquery)
+            Shout.deletedAt.is_(None)
         )
     )
-
     q = add_stat_columns(q)
-    q = apply_filters(q, options.get("filters", {}), user_id)
 
-    order_by = options.get("order_by", Shout.publishedAt)
-
-    query_order_by = desc(order_by) if options.get('order_by_desc', True) else asc(order_by)
-    offset = options.get("offset", 0)
-    limit = options.get("limit", 10)
-
-    q = q.group_by(Shout.id).order_by(nulls_last(query_order_by)).limit(limit).offset(offset)
+    if newest_first and not filters:
+        # the page is taken right from the feed storage
+        after = decode_cursor(options["after"]) if options.get("after") else None
+        ids = await FeedStorage.get(user_id, options.get("offset", 0), options.get("limit", 10), after)
+        q = q.where(Shout.id.in_(ids))
+    else:
+        # the whole feed is limited by FEED_SIZE, so it is filtered and ordered here
+        ids = await FeedStorage.get(user_id)
+        q = q.where(Shout.id.in_(ids))
+        q = apply_filters(q, filters, user_id)
+        q = apply_order(q, options)
 
     shouts = []
-    with local_session() as session:
+    async with async_session() as session:
         shouts_map = {}
-        for [shout, reacted_stat, commented_stat, rating_stat, last_comment] in session.execute(q).unique():
+        for [shout, reacted_stat, commented_stat, rating_stat, last_comment] in (await session.execute(q)).unique():
             shouts.append(shout)
             shout.stat = {
                 "viewed": shout.views,
@@ -247,6 +305,10 @@ async def get_my_feed(_, info, options):
                 "commented": commented_stat,
                 "rating": rating_stat
             }
+            set_cursor(shout, options)
             shouts_map[shout.id] = shout
 
+    if newest_first and not filters:
+        shouts = [shouts_map[shout_id] for shout_id in ids if shout_id in shouts_map]
+
     return shouts
@@ -0,0 +1,54 @@
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from base.dataloader import loader
+from base.orm import async_session
+from orm.shout import Shout, ShoutAuthor, ShoutStat
+from orm.user import User
+
+# NOTE: every loader returns values in the order of requested keys, None for missing ones
+
+
+async def get_by_ids(model, ids, *options):
+    async with async_session() as session:
+        q = select(model).where(model.id.in_(ids))
+        if options:
+            q = q.options(*options)
+        found = {e.id: e for e in (await session.execute(q)).unique().scalars()}
+    return [found.get(i) for i in ids]
+
+
+@loader("user")
+async def load_users(ids):
+    return await get_by_ids(User, ids)
+
+
+@loader("shout")
+async def load_shouts(ids):
+    return await get_by_ids(Shout, ids, joinedload(Shout.authors), joinedload(Shout.topics))
+
+
+@loader("shout_captions")
+async def load_shout_captions(shout_ids):
+    """ {user_id: caption} for every shout """
+    captions = {shout_id: {} for shout_id in shout_ids}
+    async with async_session() as session:
+        q = select(ShoutAuthor).where(ShoutAuthor.shout.in_(shout_ids))
+        for sa in (await session.execute(q)).scalars():
+            captions[sa.shout][sa.user] = sa.caption
+    return [captions[shout_id] for shout_id in shout_ids]
+
+
+@loader("shout_stat")
+async def load_shout_stats(shout_ids):
+    """ the same counters as add_stat_columns, zeros for shouts without reactions """
+    stats = {}
+    async with async_session() as session:
+        q = select(ShoutStat).where(ShoutStat.shout.in_(shout_ids))
+        for s in (await session.execute(q)).scalars():
+            stats[s.shout] = {
+                "reacted": s.reacted,
+                "commented": s.commented,
+                "rating": s.rating
+            }
+    return [stats.get(shout_id, {"reacted": 0, "commented": 0, "rating": 0}) for shout_id in shout_ids]
@@ -1,6 +1,6 @@
 from typing import List
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import and_, func, distinct, select, literal
+from sqlalchemy import and_, func, select
 from sqlalchemy.orm import aliased, joinedload
 
 from auth.authenticate import login_required
@@ -10,44 +10,24 @@ from base.resolvers import mutation, query
 from orm.reaction import Reaction
 from orm.shout import ShoutAuthor, ShoutTopic
 from orm.topic import Topic
-from orm.user import AuthorFollower, Role, User, UserRating, UserRole
+from orm.user import AuthorFollower, AuthorStat, Role, User, UserRating, UserRole
 
 # from .community import followed_communities
 from resolvers.inbox.unread import get_total_unread_counter
 from resolvers.zine.topics import followed_by_user
+from services.stat.authorstat import AuthorStatStorage
 
 
 def add_author_stat_columns(q):
-    author_followers = aliased(AuthorFollower)
-    author_following = aliased(AuthorFollower)
-    shout_author_aliased = aliased(ShoutAuthor)
-    # user_rating_aliased = aliased(UserRating)
-
-    q = q.outerjoin(shout_author_aliased).add_columns(
-        func.count(distinct(shout_author_aliased.shout)).label('shouts_stat')
-    )
-    q = q.outerjoin(author_followers, author_followers.author == User.id).add_columns(
-        func.count(distinct(author_followers.follower)).label('followers_stat')
+    """ counters are kept by AuthorStatStorage, users without a row there have none """
+    q = q.outerjoin(AuthorStat, AuthorStat.author == User.id).add_columns(
+        func.coalesce(AuthorStat.shouts, 0).label('shouts_stat'),
+        func.coalesce(AuthorStat.followers, 0).label('followers_stat'),
+        func.coalesce(AuthorStat.followings, 0).label('followings_stat'),
+        func.coalesce(AuthorStat.rating, 0).label('rating_stat'),
+        func.coalesce(AuthorStat.commented, 0).label('commented_stat')
     )
 
-    q = q.outerjoin(author_following, author_following.follower == User.id).add_columns(
-        func.count(distinct(author_following.author)).label('followings_stat')
-    )
-
-    q = q.add_columns(literal(0).label('rating_stat'))
-    # FIXME
-    # q = q.outerjoin(user_rating_aliased, user_rating_aliased.user == User.id).add_columns(
-    #     # TODO: check
-    #     func.sum(user_rating_aliased.value).label('rating_stat')
-    # )
-
-    q = q.add_columns(literal(0).label('commented_stat'))
-    # q = q.outerjoin(Reaction, and_(Reaction.createdBy == User.id, Reaction.body.is_not(None))).add_columns(
-    #     func.count(distinct(Reaction.id)).label('commented_stat')
-    # )
-
-    q = q.group_by(User.id)
-
     return q
 
 
@@ -191,41 +171,52 @@ async def update_profile(_, info, profile):
 
 @mutation.field("rateUser")
 @login_required
-async def rate_user(_, info, rated_userslug, value):
+async def rate_user(_, info, slug, value):
     auth: AuthCredentials = info.context["request"].auth
 
     with local_session() as session:
+        rated_user_id = session.execute(select(User.id).where(User.slug == slug)).scalar()
+        if rated_user_id is None:
+            return {"error": "user not found"}
         rating = (
             session.query(UserRating)
-            .filter(and_(UserRating.rater == auth.user_id, UserRating.user == rated_userslug))
+            .filter(and_(UserRating.rater == auth.user_id, UserRating.user == rated_user_id))
             .first()
         )
         if rating:
+            AuthorStatStorage.update(session, rated_user_id, rating=value - (rating.value or 0))
             rating.value = value
             session.commit()
             return {}
-    try:
-        UserRating.create(rater=auth.user_id, user=rated_userslug, value=value)
-    except Exception as err:
-        return {"error": err}
+        try:
+            session.add(UserRating(rater=auth.user_id, user=rated_user_id, value=value))
+            AuthorStatStorage.update(session, rated_user_id, rating=value)
+            session.commit()
+        except Exception as err:
+            return {"error": err}
     return {}
 
 
 # for mutation.field("follow")
 def author_follow(user_id, slug):
+    """ :return: id of the followed author, False if not followed """
     try:
         with local_session() as session:
             author = session.query(User).where(User.slug == slug).one()
-            af = AuthorFollower.create(follower=user_id, author=author.id)
+            # added to this session to be committed with the counters
+            af = AuthorFollower(follower=user_id, author=author.id)
             session.add(af)
+            AuthorStatStorage.update(session, author.id, followers=1)
+            AuthorStatStorage.update(session, user_id, followings=1)
             session.commit()
-        return True
+        return author.id
     except:
         return False
 
 
 # for mutation.field("unfollow")
 def author_unfollow(user_id, slug):
+    """ :return: id of the unfollowed author, False if not followed """
     with local_session() as session:
         flw = (
             session.query(
@@ -238,8 +229,10 @@ def author_unfollow(user_id, slug):
         )
         if flw:
             session.delete(flw)
+            AuthorStatStorage.update(session, flw.author, followers=-1)
+            AuthorStatStorage.update(session, user_id, followings=-1)
             session.commit()
-            return True
+            return flw.author
     return False
 
 
@@ -247,7 +240,7 @@ def author_unfollow(user_id, slug):
 async def get_authors_all(_, _info):
     q = select(User)
     q = add_author_stat_columns(q)
-    q = q.join(ShoutAuthor, User.id == ShoutAuthor.user)
+    q = q.where(User.id.in_(select(ShoutAuthor.user)))
 
     return get_authors_from_query(q)
 
@@ -270,7 +263,11 @@ async def load_authors_by(_, info, by, limit, offset):
     elif by.get("name"):
         q = q.filter(User.name.ilike(f"%{by['name']}%"))
     elif by.get("topic"):
-        q = q.join(ShoutAuthor).join(ShoutTopic).join(Topic).where(Topic.slug == by["topic"])
+        q = q.where(User.id.in_(
+            select(ShoutAuthor.user).join(
+                ShoutTopic, ShoutTopic.shout == ShoutAuthor.shout
+            ).join(Topic, Topic.id == ShoutTopic.topic).where(Topic.slug == by["topic"])
+        ))
     if by.get("lastSeen"):  # in days
         days_before = datetime.now(tz=timezone.utc) - timedelta(days=by["lastSeen"])
         q = q.filter(User.lastSeen > days_before)
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 from sqlalchemy import and_, asc, desc, select, text, func, case
 from sqlalchemy.orm import aliased
@@ -5,11 +6,16 @@ from sqlalchemy.orm import aliased
 from auth.authenticate import login_required
 from auth.credentials import AuthCredentials
 from base.exceptions import OperationNotAllowed
-from base.orm import local_session
+from base.orm import async_session, local_session
 from base.resolvers import mutation, query
 from orm.reaction import Reaction, ReactionKind
 from orm.shout import Shout, ShoutReactionsFollower
 from orm.user import User
+from resolvers.zine.load import encode_cursor, keyset_filter
+from services.following import FollowingManager, FollowingResult
+from services.stat.authorstat import AuthorStatStorage
+from services.stat.shoutstat import ShoutStatStorage
+from services.zine.feed import FeedStorage
 
 
 def add_reaction_stat_columns(q):
@@ -41,6 +47,7 @@ def add_reaction_stat_columns(q):
 
 
 def reactions_follow(user_id, shout_id: int, auto=False):
+    """ :return: id of the followed shout, None if followed already """
     try:
         with local_session() as session:
             shout = session.query(Shout).where(Shout.id == shout_id).one()
@@ -60,12 +67,13 @@ def reactions_follow(user_id, shout_id: int, auto=False):
                 )
                 session.add(following)
                 session.commit()
-                return True
+                return shout.id
     except:
         return False
 
 
 def reactions_unfollow(user_id: int, shout_id: int):
+    """ :return: id of the unfollowed shout, False if not followed """
     try:
         with local_session() as session:
             shout = session.query(Shout).where(Shout.id == shout_id).one()
@@ -80,7 +88,7 @@ def reactions_unfollow(user_id: int, shout_id: int):
             if following:
                 session.delete(following)
                 session.commit()
-                return True
+                return shout.id
     except:
         pass
     return False
@@ -195,8 +203,12 @@ async def create_reaction(_, info, reaction):
 
             if opposite_reaction is not None:
                 session.delete(opposite_reaction)
+                ShoutStatStorage.update(session, opposite_reaction, -1)
 
-        r = Reaction.create(**reaction)
+        r = Reaction(**reaction)
+        session.add(r)
+        # flushed for its id and createdAt, committed below together with the counters
+        session.flush()
 
         # Proposal accepting logix
         if r.replyTo is not None and \
@@ -213,7 +225,8 @@ async def create_reaction(_, info, reaction):
                     shout.body = new_body
                     # TODO: update git version control
 
-        session.add(r)
+        ShoutStatStorage.update(session, r)
+        AuthorStatStorage.update_reaction(session, r)
         session.commit()
         rdict = r.dict()
         rdict['shout'] = shout.dict()
@@ -225,12 +238,15 @@ async def create_reaction(_, info, reaction):
             set_hidden(session, r.shout)
         elif check_to_publish(session, auth.user_id, r):
             set_published(session, r.shout)
+            await FeedStorage.fanout(r.shout)
 
     try:
         reactions_follow(auth.user_id, reaction["shout"], True)
     except Exception as e:
         print(f"[resolvers.reactions] error on reactions autofollowing: {e}")
 
+    await FollowingManager.push('shout', FollowingResult("NEW", 'reaction', rdict), [rdict["shout"]["id"]])
+
     rdict['stat'] = {
         "commented": 0,
         "reacted": 0,
@@ -286,6 +302,10 @@ async def delete_reaction(_, info, id):
         if r.createdBy != auth.user_id:
             return {"error": "access denied"}
 
+        if r.deletedAt is None:
+            ShoutStatStorage.update(session, r, -1)
+            AuthorStatStorage.update_reaction(session, r, -1)
+
         if r.kind in [
             ReactionKind.LIKE,
             ReactionKind.DISLIKE
@@ -300,7 +320,7 @@ async def delete_reaction(_, info, id):
 
 
 @query.field("loadReactionsBy")
-async def load_reactions_by(_, _info, by, limit=50, offset=0):
+async def load_reactions_by(_, info, by, limit=50, offset=0, after=None):
     """
     :param by: {
         :shout - filter by slug
@@ -314,11 +334,12 @@ async def load_reactions_by(_, _info, by, limit=50, offset=0):
     }
     :param limit: int amount of shouts
     :param offset: int offset in this order
+    :param after: cursor of the last reaction on the previous page, instead of offset
     :return: Reaction[]
     """
 
     q = select(
-        Reaction, User, Shout
+        Reaction
     ).join(
         User, Reaction.createdBy == User.id
     ).join(
@@ -344,37 +365,58 @@ async def load_reactions_by(_, _info, by, limit=50, offset=0):
         q = q.filter(Reaction.body.ilike(f'%{by["body"]}%'))
 
     if by.get("days"):
-        after = datetime.now(tz=timezone.utc) - timedelta(days=int(by["days"]) or 30)
-        q = q.filter(Reaction.createdAt > after)
+        since = datetime.now(tz=timezone.utc) - timedelta(days=int(by["days"]) or 30)
+        q = q.filter(Reaction.createdAt > since)
 
     order_way = asc if by.get("sort", "").startswith("-") else desc
-    order_field = by.get("sort", "").replace('-', '') or Reaction.createdAt
+    order_field = by.get("sort", "").replace('-', '') or "createdAt"
+    by_created_at = order_field == "createdAt"
+
+    if after:
+        if not by_created_at:
+            raise ValueError("Cursor works only with sort by createdAt")
+        q = q.where(keyset_filter(Reaction.createdAt, Reaction.id, after, order_way == desc))
 
     q = q.group_by(
-        Reaction.id, User.id, Shout.id
-    ).order_by(
-        order_way(order_field)
+        Reaction.id
     )
+    if by_created_at:
+        q = q.order_by(order_way(Reaction.createdAt), order_way(Reaction.id))
+    else:
+        q = q.order_by(order_way(order_field))
 
     q = add_reaction_stat_columns(q)
 
     q = q.where(Reaction.deletedAt.is_(None))
-    q = q.limit(limit).offset(offset)
+    q = q.limit(limit)
+    if not after:
+        q = q.offset(offset)
     reactions = []
 
-    with local_session() as session:
-        for [reaction, user, shout, reacted_stat, commented_stat, rating_stat] in session.execute(q):
-            reaction.createdBy = user
-            reaction.shout = shout
-            reaction.stat = {
-                "rating": rating_stat,
-                "commented": commented_stat,
-                "reacted": reacted_stat
-            }
-
-            reaction.kind = reaction.kind.name
-
-            reactions.append(reaction)
+    async with async_session() as session:
+        rows = (await session.execute(q)).all()
+
+    # authors and shouts are repeated a lot, so they are loaded once each
+    loaders = info.context["loaders"]
+    users, shouts = await asyncio.gather(
+        loaders["user"].load_many([row[0].createdBy for row in rows]),
+        loaders["shout"].load_many([row[0].shout for row in rows])
+    )
+
+    for [reaction, reacted_stat, commented_stat, rating_stat], user, shout in zip(rows, users, shouts):
+        reaction.createdBy = user
+        reaction.shout = shout
+        reaction.stat = {
+            "rating": rating_stat,
+            "commented": commented_stat,
+            "reacted": reacted_stat
+        }
+
+        reaction.kind = reaction.kind.name
+        if by_created_at:
+            reaction.cursor = encode_cursor(reaction.createdAt, reaction.id)
+
+        reactions.append(reaction)
 
     # ?
     if by.get("stat"):
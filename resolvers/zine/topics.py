@@ -1,28 +1,24 @@
-from sqlalchemy import and_, select, distinct, func
-from sqlalchemy.orm import aliased
+from sqlalchemy import and_, select, func
+from starlette.responses import Response
 
 from auth.authenticate import login_required
 from base.orm import local_session
 from base.resolvers import mutation, query
 from orm.shout import ShoutTopic, ShoutAuthor
-from orm.topic import Topic, TopicFollower
+from orm.topic import Topic, TopicFollower, TopicStat
 from orm import User
+from services.stat.topicstat import TopicStatStorage
+from services.zine.topicscache import TopicsCache
 
 
 def add_topic_stat_columns(q):
-    aliased_shout_author = aliased(ShoutAuthor)
-    aliased_topic_follower = aliased(TopicFollower)
-
-    q = q.outerjoin(ShoutTopic, Topic.id == ShoutTopic.topic).add_columns(
-        func.count(distinct(ShoutTopic.shout)).label('shouts_stat')
-    ).outerjoin(aliased_shout_author, ShoutTopic.shout == aliased_shout_author.shout).add_columns(
-        func.count(distinct(aliased_shout_author.user)).label('authors_stat')
-    ).outerjoin(aliased_topic_follower).add_columns(
-        func.count(distinct(aliased_topic_follower.follower)).label('followers_stat')
+    """ counters are kept by TopicStatStorage, topics without a row there have none """
+    q = q.outerjoin(TopicStat, TopicStat.topic == Topic.id).add_columns(
+        func.coalesce(TopicStat.shouts, 0).label('shouts_stat'),
+        func.coalesce(TopicStat.authors, 0).label('authors_stat'),
+        func.coalesce(TopicStat.followers, 0).label('followers_stat')
     )
 
-    q = q.group_by(Topic.id)
-
     return q
 
 
@@ -57,10 +53,16 @@ def followed_by_user(user_id):
 
 @query.field("topicsAll")
 async def topics_all(_, _info):
-    q = select(Topic)
-    q = add_topic_stat_columns(q)
+    return (await TopicsCache.get()).topics
 
-    return get_topics_from_query(q)
+
+async def topics_handler(request):
+    """ topicsAll over plain http, clients revalidate it with If-None-Match """
+    cache = await TopicsCache.get()
+    headers = {"ETag": cache.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == cache.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(cache.body, media_type="application/json", headers=headers)
 
 
 @query.field("topicsByCommunity")
@@ -75,7 +77,11 @@ async def topics_by_community(_, info, community):
 async def topics_by_author(_, _info, author):
     q = select(Topic)
     q = add_topic_stat_columns(q)
-    q = q.join(User).where(User.slug == author)
+    q = q.where(Topic.id.in_(
+        select(ShoutTopic.topic).join(
+            ShoutAuthor, ShoutAuthor.shout == ShoutTopic.shout
+        ).join(User, User.id == ShoutAuthor.user).where(User.slug == author)
+    ))
 
     return get_topics_from_query(q)
 
@@ -98,6 +104,7 @@ async def create_topic(_, _info, inp):
         session.add(new_topic)
         session.commit()
 
+    await TopicsCache.invalidate()
     return {"topic": new_topic}
 
 
@@ -110,26 +117,31 @@ async def update_topic(_, _info, inp):
         if not topic:
             return {"error": "topic not found"}
         else:
-            topic.update(**inp)
+            topic.update(inp)
             session.commit()
 
-            return {"topic": topic}
+    await TopicsCache.invalidate()
+    return {"topic": topic}
 
 
 def topic_follow(user_id, slug):
+    """ :return: id of the followed topic, False if not followed """
     try:
         with local_session() as session:
             topic = session.query(Topic).where(Topic.slug == slug).one()
 
-            following = TopicFollower.create(topic=topic.id, follower=user_id)
+            # added to this session to be committed with the counters
+            following = TopicFollower(topic=topic.id, follower=user_id)
             session.add(following)
+            TopicStatStorage.update(session, topic.id, followers=1)
             session.commit()
-            return True
+            return topic.id
     except:
         return False
 
 
 def topic_unfollow(user_id, slug):
+    """ :return: id of the unfollowed topic, False if not followed """
     try:
         with local_session() as session:
             sub = (
@@ -142,8 +154,9 @@ def topic_unfollow(user_id, slug):
             )
             if sub:
                 session.delete(sub)
+                TopicStatStorage.update(session, sub.topic, followers=-1)
                 session.commit()
-                return True
+                return sub.topic
     except:
         pass
     return False
@@ -151,15 +164,4 @@ def topic_unfollow(user_id, slug):
 
 @query.field("topicsRandom")
 async def topics_random(_, info, amount=12):
-    q = select(Topic)
-    q = q.join(ShoutTopic)
-    q = q.group_by(Topic.id)
-    q = q.having(func.count(distinct(ShoutTopic.shout)) > 2)
-    q = q.order_by(func.random()).limit(amount)
-
-    topics = []
-    with local_session() as session:
-        for [topic] in session.execute(q):
-            topics.append(topic)
-
-    return topics
+    return await TopicsCache.random(amount)
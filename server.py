@@ -64,6 +64,9 @@ local_headers = [
     ("Access-Control-Allow-Credentials", "true"),
 ]
 
+# the API worker should never pay for the NLP stack, see `python3 server.py importtime`
+HEAVY_MODULES = ["transformers", "torch", "nltk", "pymystem3", "bs4", "boto3"]
+
 if __name__ == "__main__":
     x = ""
     if len(sys.argv) > 1:
@@ -93,6 +96,83 @@ if __name__ == "__main__":
         print("MODE: MIGRATE")
 
         process()
+    elif x == "stat":
+        from services.stat.authorstat import AuthorStatStorage
+        from services.stat.shoutstat import ShoutStatStorage
+        from services.stat.topicstat import TopicStatStorage
+        print("MODE: STAT")
+
+        ShoutStatStorage.rebuild()
+        AuthorStatStorage.rebuild()
+        TopicStatStorage.rebuild()
+    elif x == "feed":
+        import asyncio
+        from base.redis import redis
+        from services.zine.feed import FeedStorage
+        print("MODE: FEED")
+
+        async def backfill():
+            await redis.connect()
+            await FeedStorage.backfill()
+            await redis.disconnect()
+
+        asyncio.run(backfill())
+    elif x == "index":
+        import asyncio
+        from base.redis import redis
+        from services.search.index import ShoutIndex
+        print("MODE: INDEX")
+
+        async def build_index():
+            await redis.connect()
+            await ShoutIndex.rebuild()
+            await redis.disconnect()
+
+        asyncio.run(build_index())
+    elif x == "importtime":
+        import subprocess
+        print("MODE: IMPORTTIME")
+
+        check = "import sys, main; print(' '.join(m for m in %r if m in sys.modules))" % HEAVY_MODULES
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", check], capture_output=True, text=True)
+        imports = []
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _self, cumulative, module = line[len("import time:"):].split("|")
+                if cumulative.strip().isdigit():
+                    imports.append((int(cumulative), module.rstrip()))
+        for cumulative, module in sorted(imports, reverse=True)[:30]:
+            print("%8.1f ms %s" % (cumulative / 1000, module))
+        if result.returncode:
+            print(result.stderr.splitlines()[-1])
+            sys.exit(result.returncode)
+        elif result.stdout.strip():
+            print("imported on start: %s" % result.stdout.strip())
+            sys.exit(1)
+    elif x == "tokens":
+        import asyncio
+        from auth.tokenstorage import TokenStorage
+        from base.redis import redis
+        print("MODE: TOKENS")
+
+        async def migrate_tokens():
+            await redis.connect()
+            await TokenStorage.migrate()
+            await redis.disconnect()
+
+        asyncio.run(migrate_tokens())
+    elif x == "messages":
+        import asyncio
+        from base.redis import redis
+        from services.inbox.storage import MessageStorage
+        print("MODE: MESSAGES")
+
+        async def migrate_messages():
+            await redis.connect()
+            await MessageStorage.migrate()
+            await redis.disconnect()
+
+        asyncio.run(migrate_messages())
     elif x == "bson":
         from migration.bson2json import json_tables
         print("MODE: BSON")
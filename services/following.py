@@ -1,4 +1,32 @@
 import asyncio
+import json
+from collections import OrderedDict
+from datetime import datetime
+from enum import Enum
+from itertools import count
+
+from base.redis import redis
+
+CHANNEL_PREFIX = "following/"  # following/{kind}, every worker listens to all of them at once
+QUEUE_SIZE = 100  # undelivered events kept for a slow subscriber
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"  # a newer event about the same entity replaces the queued one
+
+
+def shout_keys(author_ids, topic_ids):
+    """ new shouts are routed by the authors and topics in one key space """
+    return ["author/%s" % author_id for author_id in author_ids] + ["topic/%s" % topic_id for topic_id in topic_ids]
+
+
+def serialize(value):
+    """ json for payloads made of orm dicts """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.name
+    return str(value)
 
 
 class FollowingResult:
@@ -7,45 +35,123 @@ class FollowingResult:
         self.kind = kind
         self.payload = payload
 
+    def entity_key(self):
+        """ the entity the event is about, for coalescing """
+        if isinstance(self.payload, dict):
+            return self.kind, self.payload.get("chatId"), self.payload.get("id")
+        return self.kind, self.payload
+
 
 class Following:
-    queue = asyncio.Queue()
+    """ one subscriber with its own bounded queue, it can follow many keys of many kinds """
 
-    def __init__(self, kind, uid):
-        self.kind = kind  # author topic shout chat
+    def __init__(self, kind, uid, maxsize=QUEUE_SIZE, policy=DROP_OLDEST):
+        self.kind = kind  # author topic shout inbox
         self.uid = uid
+        self.maxsize = maxsize
+        self.policy = policy
+        self.keys = set()  # (kind, key) this one is registered for
+        self.buffer = OrderedDict()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self._seq = count()
+
+    def put(self, payload):
+        if self.policy == COALESCE:
+            key = payload.entity_key()
+            self.buffer.pop(key, None)
+        else:
+            key = next(self._seq)
+        if len(self.buffer) >= self.maxsize:
+            self.dropped += 1
+            if self.dropped % QUEUE_SIZE == 1:
+                print("[services.following] %s %s is slow, %d events dropped" % (self.kind, self.uid, self.dropped))
+            if self.policy == DROP_NEWEST:
+                return
+            self.buffer.popitem(last=False)
+        self.buffer[key] = payload
+        self.ready.set()
+
+    async def get(self):
+        while not self.buffer:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.buffer.popitem(last=False)[1]
 
 
 class FollowingManager:
-    lock = asyncio.Lock()
+    # kind -> key -> subscribers, events are delivered to the subscribers of its key only
     data = {
-        'author': [],
-        'topic': [],
-        'shout': [],
-        'chat': []
+        'author': {},
+        'topic': {},
+        'shout': {},
+        'inbox': {}
     }
 
     @staticmethod
-    async def register(kind, uid):
-        async with FollowingManager.lock:
-            FollowingManager[kind].append(uid)
+    async def register(kind, following, keys=None):
+        """ subscribes :following to :keys of :kind, to its own uid by default """
+        by_key = FollowingManager.data.setdefault(kind, {})
+        for key in (keys if keys is not None else [following.uid]):
+            by_key.setdefault(key, set()).add(following)
+            following.keys.add((kind, key))
 
     @staticmethod
-    async def remove(kind, uid):
-        async with FollowingManager.lock:
-            FollowingManager[kind].remove(uid)
+    async def remove(kind, following):
+        """ unsubscribes :following from everything it follows """
+        for registered_kind, key in following.keys:
+            subscribers = FollowingManager.data[registered_kind].get(key)
+            if subscribers is not None:
+                subscribers.discard(following)
+                if not subscribers:
+                    del FollowingManager.data[registered_kind][key]
+        following.keys.clear()
 
     @staticmethod
-    async def push(kind, payload):
+    async def push(kind, payload, keys=None):
+        """
+        publishes :payload for the subscribers of :keys in all the workers,
+        routed by the payload itself by default
+        """
         try:
-            async with FollowingManager.lock:
-                if kind == 'chat':
-                    for chat in FollowingManager['chat']:
-                        if payload.message["chatId"] == chat.uid:
-                            chat.queue.put_nowait(payload)
-                else:
-                    for entity in FollowingManager[kind]:
-                        if payload.shout['createdBy'] == entity.uid:
-                            entity.queue.put_nowait(payload)
+            if keys is None:
+                keys = [payload.payload]
+            event = {
+                "event": payload.event,
+                "kind": payload.kind,
+                "payload": payload.payload,
+                "keys": list(keys)
+            }
+            await redis.execute("PUBLISH", CHANNEL_PREFIX + kind, json.dumps(event, default=serialize))
         except Exception as e:
             print(Exception(e))
+
+    @staticmethod
+    def deliver(kind, payload, keys):
+        """ puts :payload to the local subscribers of :keys """
+        by_key = FollowingManager.data.get(kind, {})
+        delivered = set()
+        for key in keys:
+            for following in by_key.get(key, ()):
+                if following not in delivered:
+                    delivered.add(following)
+                    following.put(payload)
+
+    @staticmethod
+    async def on_published(channel, data):
+        kind = (channel.decode("utf-8") if isinstance(channel, bytes) else channel)[len(CHANNEL_PREFIX):]
+        if not FollowingManager.data.get(kind):
+            return
+        event = json.loads(data)
+        payload = FollowingResult(event["event"], event["kind"], event["payload"])
+        FollowingManager.deliver(kind, payload, event["keys"])
+
+    @staticmethod
+    async def worker():
+        """ async task worker, one redis subscription demultiplexed to all the local subscribers """
+        while True:
+            try:
+                await redis.listen_pattern(CHANNEL_PREFIX + "*", FollowingManager.on_published)
+            except Exception as e:
+                print("[services.following] listener error: %s" % e)
+            await asyncio.sleep(1)
@@ -0,0 +1,313 @@
+import json
+
+from base.redis import redis
+
+# unread counters of a user are the hash unread/{user_id} of chat ids and the total of them
+ADD_UNREAD = """
+local function add_unread(user_id, chat_id, n)
+    local key = 'unread/' .. user_id
+    local count = tonumber(redis.call('HGET', key, chat_id) or 0)
+    if count + n < 0 then
+        n = -count
+    end
+    if n ~= 0 then
+        redis.call('HINCRBY', key, chat_id, n)
+        redis.call('HINCRBY', key, 'total', n)
+    end
+end
+"""
+
+# KEYS[1] - chat key, ARGV - author, body, createdAt, replyTo or '', chat id
+# returns the new message id and the chat users
+CREATE_MESSAGE = ADD_UNREAD + """
+local chat = redis.call('GET', KEYS[1])
+if not chat then
+    return nil
+end
+local message_id = redis.call('INCR', KEYS[1] .. '/next_message_id') - 1
+redis.call('XADD', KEYS[1] .. '/stream', message_id .. '-1',
+    'author', ARGV[1], 'body', ARGV[2], 'createdAt', ARGV[3], 'replyTo', ARGV[4])
+-- the author has read everything up to the own message
+redis.call('HSET', KEYS[1] .. '/read', ARGV[1], message_id)
+local users = cjson.decode(chat)['users']
+for _, user_id in ipairs(users) do
+    if tostring(user_id) == ARGV[1] then
+        add_unread(user_id, ARGV[5], -tonumber(redis.call('HGET', 'unread/' .. user_id, ARGV[5]) or 0))
+    else
+        add_unread(user_id, ARGV[5], 1)
+    end
+end
+chat = cjson.decode(chat)
+chat['updatedAt'] = tonumber(ARGV[3])
+-- cjson encodes an empty table as an object, while every table of a chat is a list
+redis.call('SET', KEYS[1], (string.gsub(cjson.encode(chat), '":{}', '":[]')))
+return {message_id, cjson.encode(users)}
+"""
+
+# KEYS[1] - chat key, ARGV[1] - message id, ARGV[2] - chat id
+DELETE_MESSAGE = ADD_UNREAD + """
+if redis.call('XDEL', KEYS[1] .. '/stream', ARGV[1] .. '-1') == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[1] .. '/edited', ARGV[1])
+local chat = redis.call('GET', KEYS[1])
+if chat then
+    for _, user_id in ipairs(cjson.decode(chat)['users']) do
+        local last = redis.call('HGET', KEYS[1] .. '/read', user_id)
+        if not last or tonumber(last) < tonumber(ARGV[1]) then
+            add_unread(user_id, ARGV[2], -1)
+        end
+    end
+end
+return 1
+"""
+
+# KEYS[1] - chat key, ARGV[1] - user id, ARGV[2] - message id, ARGV[3] - chat id
+# the last read id never moves back, the counter drops by the messages passed
+MARK_READ = ADD_UNREAD + """
+local last = tonumber(redis.call('HGET', KEYS[1] .. '/read', ARGV[1]) or -1)
+if tonumber(ARGV[2]) > last then
+    redis.call('HSET', KEYS[1] .. '/read', ARGV[1], ARGV[2])
+    local read = #redis.call('XRANGE', KEYS[1] .. '/stream', (last + 1) .. '-0', ARGV[2] .. '-1')
+    add_unread(ARGV[1], ARGV[3], -read)
+end
+"""
+
+# KEYS[1] - chat key, ARGV[1] - chat id
+# every user's counter is set to the number of messages after the last read one
+RECOUNT_UNREAD = ADD_UNREAD + """
+local chat = redis.call('GET', KEYS[1])
+if not chat then
+    return 0
+end
+local users = cjson.decode(chat)['users']
+for _, user_id in ipairs(users) do
+    local last = redis.call('HGET', KEYS[1] .. '/read', user_id)
+    local start = '-'
+    if last then
+        start = (tonumber(last) + 1) .. '-0'
+    end
+    local count = #redis.call('XRANGE', KEYS[1] .. '/stream', start, '+')
+    add_unread(user_id, ARGV[1], count - tonumber(redis.call('HGET', 'unread/' .. user_id, ARGV[1]) or 0))
+end
+return #users
+"""
+
+# drops the counter of a chat from the unread hash, the total goes down with it
+FORGET = """
+local function forget(key, chat_id)
+    local n = tonumber(redis.call('HGET', key, chat_id) or 0)
+    redis.call('HDEL', key, chat_id)
+    if n ~= 0 then
+        redis.call('HINCRBY', key, 'total', -n)
+    end
+end
+"""
+
+# KEYS - unread counters hashes, ARGV[1] - chat id
+FORGET_UNREAD = FORGET + """
+for _, key in ipairs(KEYS) do
+    forget(key, ARGV[1])
+end
+"""
+
+# KEYS[1] - chat key, ARGV[1] - chat id
+# the chat, its messages and the counters and chat lists of its users go at once
+DELETE_CHAT = FORGET + """
+local chat = redis.call('GET', KEYS[1])
+if not chat then
+    return 0
+end
+for _, user_id in ipairs(cjson.decode(chat)['users']) do
+    redis.call('SREM', 'chats_by_user/' .. user_id, ARGV[1])
+    forget('unread/' .. user_id, ARGV[1])
+end
+redis.call('DEL', KEYS[1], KEYS[1] .. '/stream', KEYS[1] .. '/edited', KEYS[1] .. '/read', KEYS[1] .. '/next_message_id')
+return 1
+"""
+
+
+def stream_id(message_id):
+    """ message ids start from 0 while 0-0 is not a valid stream id """
+    return f"{message_id}-1"
+
+
+def decoded(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def entry_fields(message):
+    """ the same fields in every entry, so the stream stores their names once per node """
+    return [
+        "author", message["author"],
+        "body", message["body"],
+        "createdAt", message["createdAt"],
+        "replyTo", message.get("replyTo") or ""
+    ]
+
+
+def to_message(chat_id, entry_id, fields):
+    fields = {decoded(k): decoded(v) for k, v in fields.items()}
+    message = {
+        "id": int(decoded(entry_id).split("-")[0]),
+        "chatId": chat_id,
+        "author": int(fields["author"]),
+        "body": fields["body"],
+        "createdAt": int(fields["createdAt"])
+    }
+    if fields.get("replyTo"):
+        message["replyTo"] = int(fields["replyTo"])
+    return message
+
+
+class MessageStorage:
+    """
+    messages of a chat are entries of the stream chats/{id}/stream with the message id as the stream id,
+    edits are kept aside in the hash chats/{id}/edited as streams are append only,
+    the id of the last message read by every user is in the hash chats/{id}/read,
+    unread counters are kept up to date by the scripts creating, deleting and marking messages
+    """
+
+    @staticmethod
+    async def create(chat_id, message):
+        """ :return: the message with its id and the chat users, or None if there is no such chat """
+        created = await redis.evalsha(CREATE_MESSAGE, [f"chats/{chat_id}"], entry_fields(message)[1::2] + [chat_id])
+        if not created:
+            return None, []
+        message_id, users = created
+        return dict(message, id=int(message_id), chatId=chat_id), json.loads(users)
+
+    @staticmethod
+    async def with_edits(messages):
+        """ applies the edits to :messages in one round trip """
+        if not messages:
+            return messages
+        async with redis.pipeline() as pipe:
+            for m in messages:
+                pipe.execute("HGET", f"chats/{m['chatId']}/edited", m["id"])
+        for m, edit in zip(messages, pipe.results):
+            if edit:
+                m.update(json.loads(edit))
+        return messages
+
+    @staticmethod
+    async def get_many(chat_id, message_ids):
+        async with redis.pipeline() as pipe:
+            for message_id in message_ids:
+                pipe.execute("XRANGE", f"chats/{chat_id}/stream", stream_id(message_id), stream_id(message_id))
+        messages = [to_message(chat_id, *entries[0]) for entries in pipe.results if entries]
+        return await MessageStorage.with_edits(messages)
+
+    @staticmethod
+    async def get(chat_id, message_id):
+        messages = await MessageStorage.get_many(chat_id, [message_id])
+        return messages[0] if messages else None
+
+    @staticmethod
+    async def last(chat_ids, limit, offset=0):
+        """ :limit messages of every chat of :chat_ids skipping :offset newest ones """
+        async with redis.pipeline() as pipe:
+            for chat_id in chat_ids:
+                pipe.execute("XREVRANGE", f"chats/{chat_id}/stream", "+", "-", "COUNT", offset + limit)
+        by_chat = [
+            [to_message(chat_id, *entry) for entry in (entries or [])[offset:]]
+            for chat_id, entries in zip(chat_ids, pipe.results)
+        ]
+        await MessageStorage.with_edits([m for messages in by_chat for m in messages])
+        return by_chat
+
+    @staticmethod
+    async def update(chat_id, message):
+        edit = {"body": message["body"], "updatedAt": message["updatedAt"]}
+        await redis.execute("HSET", f"chats/{chat_id}/edited", message["id"], json.dumps(edit))
+
+    @staticmethod
+    async def delete(chat_id, message_id):
+        await redis.evalsha(DELETE_MESSAGE, [f"chats/{chat_id}"], [message_id, chat_id])
+
+    @staticmethod
+    async def mark_read(chat_id, user_id, message_ids):
+        """ everything up to the newest of :message_ids is read """
+        if message_ids:
+            newest = max(int(i) for i in message_ids)
+            await redis.evalsha(MARK_READ, [f"chats/{chat_id}"], [user_id, newest, chat_id])
+
+    @staticmethod
+    async def unread(keys):
+        """ :keys are (chat_id, user_id) pairs, read in one round trip """
+        async with redis.pipeline() as pipe:
+            for chat_id, user_id in keys:
+                pipe.execute("HGET", f"unread/{user_id}", chat_id)
+        return [int(n or 0) for n in pipe.results]
+
+    @staticmethod
+    async def total_unread(user_id):
+        return int(await redis.execute("HGET", f"unread/{user_id}", "total") or 0)
+
+    @staticmethod
+    async def forget(chat_id, user_ids):
+        """ drops the counters of the chat :user_ids have left """
+        if user_ids:
+            await redis.evalsha(FORGET_UNREAD, [f"unread/{user_id}" for user_id in user_ids], [chat_id])
+
+    @staticmethod
+    async def drop(chat_id):
+        """ deletes the chat with its messages and the counters of its users """
+        await redis.evalsha(DELETE_CHAT, [f"chats/{chat_id}"], [chat_id])
+
+    @staticmethod
+    async def recount(chat_id):
+        """ sets the unread counters of the chat users from their last read ids """
+        await redis.evalsha(RECOUNT_UNREAD, [f"chats/{chat_id}"], [chat_id])
+
+    @staticmethod
+    async def migrate():
+        """ converts chats/{id}/messages/{mid} keys with their id and unread lists to streams """
+        converted = 0
+        cursor = 0
+        while True:
+            cursor, keys = await redis.execute("SCAN", cursor, "MATCH", "chats/*/message_ids", "COUNT", 1000)
+            for key in keys:
+                chat_id = decoded(key).split("/")[1]
+                converted += await MessageStorage.migrate_chat(chat_id)
+            if int(cursor) == 0:
+                break
+        print("[inbox.storage] %d messages converted" % converted)
+        recounted = 0
+        while True:
+            cursor, keys = await redis.execute("SCAN", cursor, "MATCH", "chats/*/stream", "COUNT", 1000)
+            for key in keys:
+                await MessageStorage.recount(decoded(key).split("/")[1])
+                recounted += 1
+            if int(cursor) == 0:
+                break
+        print("[inbox.storage] unread counters of %d chats recounted" % recounted)
+
+    @staticmethod
+    async def migrate_chat(chat_id):
+        chat = await redis.execute("GET", f"chats/{chat_id}")
+        users = json.loads(chat)["users"] if chat else []
+        message_ids = sorted(set(int(i) for i in await redis.execute("LRANGE", f"chats/{chat_id}/message_ids", 0, -1)))
+        messages = await redis.mget_json([f"chats/{chat_id}/messages/{i}" for i in message_ids])
+        async with redis.pipeline() as pipe:
+            for user_id in users:
+                pipe.execute("LRANGE", f"chats/{chat_id}/unread/{user_id}", 0, -1)
+        unread = [[int(i) for i in ids] for ids in pipe.results]
+
+        async with redis.transaction() as tr:
+            tr.execute("DEL", f"chats/{chat_id}/stream", f"chats/{chat_id}/edited", f"chats/{chat_id}/read")
+            for message_id, message in zip(message_ids, messages):
+                if not message:
+                    continue
+                tr.execute("XADD", f"chats/{chat_id}/stream", stream_id(message_id), *entry_fields(message))
+                if message.get("updatedAt"):
+                    edit = {"body": message["body"], "updatedAt": message["updatedAt"]}
+                    tr.execute("HSET", f"chats/{chat_id}/edited", message_id, json.dumps(edit))
+            last_id = message_ids[-1] if message_ids else -1
+            for user_id, ids in zip(users, unread):
+                # read up to the oldest unread one
+                tr.execute("HSET", f"chats/{chat_id}/read", user_id, min(ids) - 1 if ids else last_id)
+            tr.execute("DEL", f"chats/{chat_id}/message_ids", *[f"chats/{chat_id}/unread/{u}" for u in users])
+            for message_id in message_ids:
+                tr.execute("DEL", f"chats/{chat_id}/messages/{message_id}")
+        return len(message_ids)
@@ -0,0 +1,62 @@
+import json
+
+from base.redis import redis
+from services.following import FollowingManager, FollowingResult
+
+INBOX_SIZE = 1000  # events kept for a reconnecting subscriber, trimmed approximately
+REPLAY_LIMIT = 1000
+
+
+def decoded(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def inbox_key(user_id):
+    return f"inbox/{user_id}"
+
+
+def parse_id(stream_id):
+    """ stream ids compare as (milliseconds, sequence) """
+    ms, _, seq = str(stream_id).partition("-")
+    return int(ms), int(seq or 0)
+
+
+class InboxStream:
+    """
+    every chat event is appended to the stream of each chat member
+    and pushed live to the member's connections with its stream id,
+    so a subscriber can resume after a reconnect from the last id it has seen
+    """
+
+    @staticmethod
+    async def add(user_ids, result):
+        """ appends :result to the inboxes of :user_ids and notifies them """
+        event = json.dumps({"event": result.event, "kind": result.kind, "payload": result.payload})
+        user_ids = list(user_ids)
+        async with redis.pipeline() as pipe:
+            for user_id in user_ids:
+                pipe.execute("XADD", inbox_key(user_id), "MAXLEN", "~", INBOX_SIZE, "*", "event", event)
+        # one publish for all the members, every one picks the own id out
+        stream_ids = {str(user_id): decoded(stream_id) for user_id, stream_id in zip(user_ids, pipe.results)}
+        payload = dict(result.payload, streamIds=stream_ids)
+        await FollowingManager.push('inbox', FollowingResult(result.event, 'inbox', payload), user_ids)
+
+    @staticmethod
+    def payload_for(result, user_id):
+        """ the event as seen by :user_id, with the id in the user's stream """
+        payload = dict(result.payload)
+        stream_ids = payload.pop("streamIds", None)
+        if stream_ids is not None:
+            payload["streamId"] = stream_ids[str(user_id)]
+        return payload
+
+    @staticmethod
+    async def replay(user_id, after, limit=REPLAY_LIMIT):
+        """ events of :user_id newer than the :after stream id, the oldest first """
+        entries = await redis.execute("XRANGE", inbox_key(user_id), "(" + after, "+", "COUNT", limit)
+        results = []
+        for stream_id, fields in entries or []:
+            event = json.loads(fields[b"event"])
+            payload = dict(event["payload"], streamId=decoded(stream_id))
+            results.append(FollowingResult(event["event"], 'inbox', payload))
+        return results
@@ -1,4 +1,7 @@
 from services.search import SearchService
+from services.stat.authorstat import AuthorStatStorage
+from services.stat.shoutstat import ShoutStatStorage
+from services.stat.topicstat import TopicStatStorage
 from services.stat.viewed import ViewedStorage
 from base.orm import local_session
 
@@ -9,5 +12,8 @@ async def storages_init():
         await SearchService.init(session)
         print('[main] SearchService initialized')
         print('[main] initialize storages')
+        ShoutStatStorage.init(session)
+        AuthorStatStorage.init(session)
+        TopicStatStorage.init(session)
         await ViewedStorage.init()
         print('[main] storages initialized')
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import time
+from itertools import groupby
+
+import httpx
+
+from base.redis import redis
+from settings import MAILGUN_API_KEY, MAILGUN_API_URL
+
+OUTBOX_KEY = "emails/outbox"  # list of messages to send, pushed left, taken right
+RETRY_KEY = "emails/retry"  # messages by the time of the next attempt
+DEAD_KEY = "emails/dead"  # messages failed for good, the newest first
+PROCESSING_KEY = "emails/processing"  # taken messages by the time they are given up on
+BATCH_SIZE = 100  # mailgun takes up to 1000 recipients at once
+MAX_ATTEMPTS = 6
+BACKOFF = 30  # seconds before the first retry, doubled every next one
+POLL = 1  # seconds to wait for new messages
+DEAD_SIZE = 1000
+PROCESSING_TIMEOUT = 300  # seconds, messages of a crashed worker are sent again after that
+
+# KEYS - outbox, retry, processing, ARGV - now, batch size, processing deadline
+# due retries and messages taken by crashed workers go back to the outbox first,
+# then the oldest ones are taken until the deadline
+TAKE = """
+for _, key in ipairs({KEYS[2], KEYS[3]}) do
+    local due = redis.call('ZRANGEBYSCORE', key, 0, ARGV[1])
+    if #due > 0 then
+        redis.call('ZREMRANGEBYSCORE', key, 0, ARGV[1])
+        for _, message in ipairs(due) do
+            redis.call('LPUSH', KEYS[1], message)
+        end
+    end
+end
+local size = tonumber(ARGV[2])
+local taken = redis.call('LRANGE', KEYS[1], -size, -1)
+redis.call('LTRIM', KEYS[1], 0, -size - 1)
+for _, message in ipairs(taken) do
+    redis.call('ZADD', KEYS[3], ARGV[3], message)
+end
+return taken
+"""
+
+
+def batch_key(message):
+    return message["from"], message["subject"], message["template"]
+
+
+def batches(messages):
+    """ messages of the same template, every address once in a batch """
+    for _key, same in groupby(sorted(messages, key=batch_key), key=batch_key):
+        batch = {}
+        for message in same:
+            if message["email"] in batch:
+                yield list(batch.values())
+                batch = {}
+            batch[message["email"]] = message
+        yield list(batch.values())
+
+
+def is_permanent(response):
+    """ client errors are not going to change on retry, except rate limiting """
+    return response.status_code < 500 and response.status_code != 429
+
+
+class EmailOutbox:
+    """
+    transactional emails are queued in redis and sent by a worker in every process,
+    messages with the same template go to mailgun in one request with recipient variables
+    """
+
+    @staticmethod
+    async def push(message):
+        """
+        :param message: {
+            from: "discours.io <noreply@discours.io>",
+            to: "Name <email>",
+            email: "email",
+            subject: "...",
+            template: "email_confirmation_ru",
+            variables: { token: "..." }
+        }
+        """
+        message["attempts"] = 0
+        await redis.execute("LPUSH", OUTBOX_KEY, json.dumps(message))
+
+    @staticmethod
+    async def take(now=None):
+        """ the oldest messages, kept in processing until they are done or failed """
+        now = now or time.time()
+        taken = await redis.evalsha(TAKE, [OUTBOX_KEY, RETRY_KEY, PROCESSING_KEY], [
+            now, BATCH_SIZE, now + PROCESSING_TIMEOUT
+        ])
+        return [json.loads(m) for m in reversed(taken or [])]
+
+    @staticmethod
+    def taken(messages):
+        """ messages are always written with json.dumps, so they serialize back to the same members """
+        return [json.dumps(message) for message in messages]
+
+    @staticmethod
+    async def done(messages):
+        await redis.execute("ZREM", PROCESSING_KEY, *EmailOutbox.taken(messages))
+
+    @staticmethod
+    async def send(client, messages):
+        """ one request for :messages of the same template, raises on failure """
+        first = messages[0]
+        payload = {
+            "from": first["from"],
+            "to": [m["to"] for m in messages],
+            "subject": first["subject"],
+            "template": first["template"],
+            "h:X-Mailgun-Variables": json.dumps({k: "%recipient." + k + "%" for k in first["variables"]}),
+            # without it every recipient sees the others
+            "recipient-variables": json.dumps({m["email"]: m["variables"] for m in messages})
+        }
+        response = await client.post(MAILGUN_API_URL, auth=("api", MAILGUN_API_KEY or ""), data=payload)
+        response.raise_for_status()
+
+    @staticmethod
+    async def fail(messages, error):
+        taken = EmailOutbox.taken(messages)
+        retries = {}
+        dead = []
+        for message in messages:
+            message["attempts"] += 1
+            message["error"] = str(error)
+            if message["attempts"] >= MAX_ATTEMPTS or getattr(error, "permanent", False):
+                dead.append(json.dumps(message))
+            else:
+                due = time.time() + BACKOFF * 2 ** (message["attempts"] - 1)
+                retries[json.dumps(message)] = due
+        async with redis.transaction() as pipe:
+            pipe.execute("ZREM", PROCESSING_KEY, *taken)
+            if retries:
+                pipe.execute("ZADD", RETRY_KEY, *[x for m, due in retries.items() for x in (due, m)])
+            if dead:
+                pipe.execute("LPUSH", DEAD_KEY, *dead)
+                pipe.execute("LTRIM", DEAD_KEY, 0, DEAD_SIZE - 1)
+        print("[outbox] %d emails failed: %s, %d to retry" % (len(messages), error, len(retries)))
+
+    @staticmethod
+    async def deliver(client, batch):
+        """
+        sends :batch, a batch rejected for good is sent again recipient by recipient,
+        so only the messages failing alone are dead lettered
+        """
+        try:
+            await EmailOutbox.send(client, batch)
+        except httpx.HTTPStatusError as e:
+            e.permanent = is_permanent(e.response)
+            if e.permanent and len(batch) > 1:
+                for message in batch:
+                    await EmailOutbox.deliver(client, [message])
+            else:
+                await EmailOutbox.fail(batch, e)
+            return
+        except Exception as e:
+            await EmailOutbox.fail(batch, e)
+            return
+        print("[outbox] %d emails sent" % len(batch))
+        try:
+            await EmailOutbox.done(batch)
+        except Exception as e:
+            # delivery is at least once: the batch is sent again after PROCESSING_TIMEOUT
+            print("[outbox] %d sent emails are left in processing: %s" % (len(batch), e))
+
+    @staticmethod
+    async def process(client):
+        """ one step of the worker, :return: the number of messages taken """
+        messages = await EmailOutbox.take()
+        for batch in batches(messages):
+            await EmailOutbox.deliver(client, batch)
+        return len(messages)
+
+    @staticmethod
+    async def worker():
+        """ async task worker sending queued emails """
+        async with httpx.AsyncClient(timeout=10) as client:
+            while True:
+                try:
+                    taken = await EmailOutbox.process(client)
+                except Exception as e:
+                    print("[outbox] redis error: %s" % e)
+                    taken = 0
+                if not taken:
+                    await asyncio.sleep(POLL)
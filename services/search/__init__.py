@@ -0,0 +1,94 @@
+import json
+from hashlib import sha1
+
+from sqlalchemy import and_, desc, func, literal_column, select
+
+from base.orm import async_session
+from base.redis import redis
+from orm.shout import SEARCH_CONFIG, Shout
+from services.search.index import ShoutIndex
+from settings import SEARCH_CACHE_TTL, SEARCH_MODE
+
+HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=30, MinWords=10, StartSel=<b>, StopSel=</b>"
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def search_query(text):
+    """ query text is matched both ways, the language of a request is unknown """
+    return func.websearch_to_tsquery("russian", text).op("||")(func.websearch_to_tsquery("english", text))
+
+
+def search_filter(text):
+    return Shout.searchVector.op("@@")(search_query(text))
+
+
+class SearchService:
+
+    @staticmethod
+    async def init(session):
+        if SEARCH_MODE == "index":
+            print('[search.service] BM25 search by the lemmatized shouts index')
+            await ShoutIndex.load()
+        else:
+            print('[search.service] full-text search by shout.searchVector')
+
+    @staticmethod
+    async def worker():
+        if SEARCH_MODE == "index":
+            await ShoutIndex.worker()
+
+    @staticmethod
+    async def update(shout):
+        """ postgres maintains shout.searchVector by itself, the index needs a push """
+        if SEARCH_MODE == "index":
+            await ShoutIndex.update(shout)
+
+    @staticmethod
+    async def search(text, limit=50, offset=0):
+        """
+        :return: [{ id, rank, snippet }] of published shouts, the most relevant first
+        """
+        text = normalize(text)
+        if not text:
+            return []
+        key = "search/%s/%s/%d/%d" % (SEARCH_MODE, sha1(text.encode("utf-8")).hexdigest(), limit, offset)
+        cached = await redis.execute("GET", key)
+        if cached:
+            return json.loads(cached)
+
+        if SEARCH_MODE == "index":
+            payload = [
+                {"id": shout_id, "rank": score, "snippet": None}
+                for shout_id, score in await ShoutIndex.search(text, limit, offset)
+            ]
+        else:
+            payload = await SearchService.search_fts(text, limit, offset)
+        await redis.execute("SET", key, json.dumps(payload), "EX", SEARCH_CACHE_TTL)
+        return payload
+
+    @staticmethod
+    async def search_fts(text, limit, offset):
+        query = search_query(text)
+        rank = func.ts_rank(Shout.searchVector, query)
+        hits = select(Shout.id, rank.label("rank")).where(
+            and_(
+                Shout.searchVector.op("@@")(query),
+                Shout.deletedAt.is_(None),
+                Shout.publishedAt.is_not(None)
+            )
+        ).order_by(desc("rank"), desc(Shout.id)).limit(limit).offset(offset).subquery()
+        # headlines are the slowest part, so only the page of hits gets them
+        q = select(
+            hits.c.id,
+            hits.c.rank,
+            func.ts_headline(literal_column(SEARCH_CONFIG), Shout.body, query, HEADLINE_OPTIONS)
+        ).join(Shout, Shout.id == hits.c.id).order_by(desc(hits.c.rank), desc(hits.c.id))
+
+        async with async_session() as session:
+            return [
+                {"id": shout_id, "rank": float(shout_rank), "snippet": snippet}
+                for [shout_id, shout_rank, snippet] in await session.execute(q)
+            ]
@@ -0,0 +1,242 @@
+import asyncio
+import heapq
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections import Counter
+from math import log
+
+from sqlalchemy import and_, select
+
+from base.orm import local_session
+from base.redis import redis
+from orm.shout import Shout
+from settings import SEARCH_INDEX_PATH
+
+# file layout, all numbers are native uint32 except the header:
+# header | doc ids | doc lengths | term starts | vocabulary | postings of (doc number, term frequency)
+HEADER = struct.Struct("=4sIIIQQ")  # magic, docs, terms, reserved, vocabulary bytes, postings items
+MAGIC = b"SIX1"
+UPDATED_CHANNEL = "search/updated"
+DELTA_KEY = "search/delta"  # shout id -> json tokens, "" for removed, updates since the last build
+
+# KEYS[1] - delta, ARGV - shout id and tokens pairs taken before the build
+# drops the updates the build already has, the ones made while it was running stay
+FORGET_BUILT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+"""
+
+K1 = 1.2
+B = 0.75
+
+
+def preprocess(text, html=True):
+    """ lemmas of the text without stopwords, ai.preprocess is heavy so it is imported on demand """
+    from ai.preprocess import get_clear_text
+    return get_clear_text(text or "", html).split()
+
+
+def preprocess_all(texts):
+    from ai.preprocess import preprocess_corpus
+    for clear_text in preprocess_corpus(text or "" for text in texts):
+        yield clear_text.split()
+
+
+def uint32(values):
+    a = array("I", values)
+    assert a.itemsize == 4
+    return a
+
+
+class ShoutIndex:
+    """
+    BM25 over the memory-mapped base segment built by `server.py index`,
+    plus the in-memory delta of shouts created or updated since that build
+    """
+    lock = asyncio.Lock()
+    # base segment
+    mm = None
+    doc_ids = ()
+    doc_lens = ()
+    term_starts = ()
+    postings = ()
+    vocabulary = {}  # term -> term number
+    base_docs = {}  # shout id -> doc number
+    # delta
+    docs = {}  # shout id -> (length, Counter)
+    delta = {}  # term -> {shout id: tf}
+    removed = set()  # base shout ids masked by the delta
+    # totals
+    n_docs = 0
+    total_len = 0
+
+    @staticmethod
+    def build(path=SEARCH_INDEX_PATH):
+        """ writes the base segment for all published shouts """
+        doc_ids = uint32([])
+        doc_lens = uint32([])
+        terms = {}  # term -> [doc number, tf, doc number, tf, ...]
+        with local_session() as session:
+            q = select(Shout.id, Shout.body).where(
+                and_(Shout.deletedAt.is_(None), Shout.publishedAt.is_not(None))
+            ).order_by(Shout.id).execution_options(yield_per=1000)
+
+            def bodies():
+                for [shout_id, body] in session.execute(q):
+                    doc_ids.append(shout_id)
+                    yield body
+
+            for doc, tokens in enumerate(preprocess_all(bodies())):
+                doc_lens.append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    terms.setdefault(term, uint32([])).extend((doc, tf))
+
+        vocabulary = sorted(terms.keys())
+        term_starts = uint32([0])
+        postings = uint32([])
+        for term in vocabulary:
+            postings.extend(terms.pop(term))
+            term_starts.append(len(postings))
+        vocabulary = "\n".join(vocabulary).encode("utf-8")
+        vocabulary += b"\0" * (-len(vocabulary) % 4)
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(doc_ids), len(term_starts) - 1, 0, len(vocabulary), len(postings)))
+            doc_ids.tofile(f)
+            doc_lens.tofile(f)
+            term_starts.tofile(f)
+            f.write(vocabulary)
+            postings.tofile(f)
+        os.replace(tmp, path)
+        print("[search.index] %d shouts, %d terms written to %s" % (len(doc_ids), len(term_starts) - 1, path))
+
+    @staticmethod
+    async def rebuild(path=SEARCH_INDEX_PATH):
+        """ builds the base segment and clears the delta it has made needless """
+        saved = await redis.execute("HGETALL", DELTA_KEY) or {}
+        ShoutIndex.build(path)
+        if saved:
+            await redis.evalsha(FORGET_BUILT, [DELTA_KEY], [x for item in saved.items() for x in item])
+        print("[search.index] %d updates merged into the build" % len(saved))
+
+    @staticmethod
+    async def load(path=SEARCH_INDEX_PATH):
+        """ maps the base segment and replays the delta saved in redis """
+        self = ShoutIndex
+        if not os.path.exists(path):
+            print("[search.index] %s not found, run `python3 server.py index`" % path)
+            return
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_docs, n_terms, _reserved, vocabulary_size, n_postings = HEADER.unpack_from(mm)
+        if magic != MAGIC:
+            print("[search.index] %s is not an index file" % path)
+            return
+        uints = memoryview(mm)[HEADER.size:].cast("I")
+        doc_ids = uints[:n_docs]
+        doc_lens = uints[n_docs:2 * n_docs]
+        term_starts = uints[2 * n_docs:2 * n_docs + n_terms + 1]
+        offset = HEADER.size + 4 * (2 * n_docs + n_terms + 1)
+        vocabulary = bytes(mm[offset:offset + vocabulary_size]).rstrip(b"\0").decode("utf-8")
+        postings = uints[(offset + vocabulary_size - HEADER.size) // 4:][:n_postings]
+
+        async with self.lock:
+            self.mm = mm
+            self.doc_ids, self.doc_lens, self.term_starts, self.postings = doc_ids, doc_lens, term_starts, postings
+            self.vocabulary = {term: i for i, term in enumerate(vocabulary.split("\n"))} if n_terms else {}
+            self.base_docs = {shout_id: doc for doc, shout_id in enumerate(doc_ids)}
+            self.docs, self.delta, self.removed = {}, {}, set()
+            self.n_docs = n_docs
+            self.total_len = sum(doc_lens)
+
+        saved = await redis.execute("HGETALL", DELTA_KEY) or {}
+        for shout_id, tokens in saved.items():
+            self.apply(int(shout_id), json.loads(tokens) if tokens else None)
+        print("[search.index] %d shouts mapped, %d updated since the build" % (n_docs, len(saved)))
+
+    @staticmethod
+    def apply(shout_id, tokens):
+        """ replaces the shout in the delta, None tokens remove it """
+        self = ShoutIndex
+        if shout_id in self.docs:
+            length, counts = self.docs.pop(shout_id)
+            for term in counts:
+                self.delta[term].pop(shout_id, None)
+            self.n_docs -= 1
+            self.total_len -= length
+        elif shout_id in self.base_docs and shout_id not in self.removed:
+            self.removed.add(shout_id)
+            self.n_docs -= 1
+            self.total_len -= self.doc_lens[self.base_docs[shout_id]]
+        if tokens is not None:
+            counts = Counter(tokens)
+            self.docs[shout_id] = (len(tokens), counts)
+            for term, tf in counts.items():
+                self.delta.setdefault(term, {})[shout_id] = tf
+            self.n_docs += 1
+            self.total_len += len(tokens)
+
+    @staticmethod
+    async def update(shout):
+        """ indexes the shout if it is published, drops it otherwise """
+        self = ShoutIndex
+        tokens = None
+        if shout.publishedAt and not shout.deletedAt:
+            tokens = await asyncio.get_running_loop().run_in_executor(None, preprocess, shout.body)
+        elif shout.id not in self.docs and shout.id not in self.base_docs:
+            return
+        async with redis.pipeline() as pipe:
+            pipe.execute("HSET", DELTA_KEY, shout.id, json.dumps(tokens) if tokens is not None else "")
+            pipe.execute("PUBLISH", UPDATED_CHANNEL, json.dumps({"id": shout.id, "tokens": tokens}))
+
+    @staticmethod
+    async def on_updated(data):
+        message = json.loads(data)
+        ShoutIndex.apply(message["id"], message["tokens"])
+
+    @staticmethod
+    async def worker():
+        """ async task worker applying updates made by all the workers """
+        while True:
+            try:
+                await redis.listen(UPDATED_CHANNEL, ShoutIndex.on_updated)
+            except Exception as e:
+                print("[search.index] listener error: %s" % e)
+            await asyncio.sleep(1)
+
+    @staticmethod
+    async def search(text, limit=50, offset=0):
+        """ :return: [(shout id, score)], the best first """
+        self = ShoutIndex
+        # a query is plain text, not html
+        terms = await asyncio.get_running_loop().run_in_executor(None, preprocess, text, False)
+        if not self.n_docs:
+            return []
+        avg_len = self.total_len / self.n_docs
+        scores = {}
+        for term in set(terms):
+            matches = []
+            t = self.vocabulary.get(term)
+            if t is not None:
+                p = self.postings[self.term_starts[t]:self.term_starts[t + 1]]
+                for i in range(0, len(p), 2):
+                    shout_id = self.doc_ids[p[i]]
+                    if shout_id not in self.removed:
+                        matches.append((shout_id, p[i + 1], self.doc_lens[p[i]]))
+            for shout_id, tf in self.delta.get(term, {}).items():
+                matches.append((shout_id, tf, self.docs[shout_id][0]))
+            if not matches:
+                continue
+            idf = log(1 + (self.n_docs - len(matches) + 0.5) / (len(matches) + 0.5))
+            for shout_id, tf, length in matches:
+                score = idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_len))
+                scores[shout_id] = scores.get(shout_id, 0) + score
+        best = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+        return best[offset:]
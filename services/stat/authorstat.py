@@ -0,0 +1,65 @@
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from base.orm import local_session
+from orm.reaction import Reaction, ReactionKind
+from orm.shout import Shout, ShoutAuthor
+from orm.user import AuthorFollower, AuthorStat, User, UserRating
+from services.stat.shoutstat import reaction_kind
+
+COUNTERS = ("shouts", "followers", "followings", "rating", "commented")
+
+
+class AuthorStatStorage:
+    """ author_stat table keeps shouts, followers, rating and comments counters of every user """
+
+    @staticmethod
+    def init(session):
+        if not session.query(AuthorStat).first():
+            print('[stat.authors] author_stat table is empty, rebuilding')
+            AuthorStatStorage.rebuild()
+
+    @staticmethod
+    def update(session, author_id, **deltas):
+        """ adds :deltas to the author counters, e.g. update(session, 1, followers=-1) """
+        q = insert(AuthorStat).values(author=author_id, **deltas)
+        q = q.on_conflict_do_update(
+            index_elements=[AuthorStat.author],
+            set_={name: getattr(AuthorStat, name) + delta for name, delta in deltas.items()}
+        )
+        session.execute(q)
+
+    @staticmethod
+    def update_reaction(session, reaction, sign=1):
+        """ counts :reaction if it is a comment, sign=-1 reverts it """
+        if reaction_kind(reaction) == ReactionKind.COMMENT:
+            AuthorStatStorage.update(session, reaction.createdBy, commented=sign)
+
+    @staticmethod
+    def rebuild():
+        """ recounts all the stats to fix a drift """
+        value = func.count().label("value")
+        counters = {
+            "shouts": select(ShoutAuthor.user.label("author"), value).join(
+                Shout, Shout.id == ShoutAuthor.shout
+            ).where(Shout.deletedAt.is_(None)).group_by(ShoutAuthor.user),
+            "followers": select(AuthorFollower.author.label("author"), value).group_by(AuthorFollower.author),
+            "followings": select(AuthorFollower.follower.label("author"), value).group_by(AuthorFollower.follower),
+            "rating": select(UserRating.user.label("author"), func.sum(UserRating.value).label("value")).group_by(
+                UserRating.user
+            ),
+            "commented": select(Reaction.createdBy.label("author"), value).where(
+                and_(Reaction.kind == ReactionKind.COMMENT, Reaction.deletedAt.is_(None))
+            ).group_by(Reaction.createdBy)
+        }
+        counters = [counters[name].subquery(name) for name in COUNTERS]
+
+        q = select(User.id, *[func.coalesce(c.c.value, 0) for c in counters])
+        for c in counters:
+            q = q.outerjoin(c, c.c.author == User.id)
+
+        with local_session() as session:
+            session.execute(delete(AuthorStat))
+            session.execute(insert(AuthorStat).from_select(["author", *COUNTERS], q))
+            session.commit()
+            print('[stat.authors] %d authors stat rebuilt' % session.query(AuthorStat).count())
@@ -0,0 +1,104 @@
+from sqlalchemy import and_, case, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from base.orm import local_session
+from orm.reaction import Reaction, ReactionKind
+from orm.shout import ShoutStat
+
+RATING_KINDS = {
+    ReactionKind.AGREE: 1,
+    ReactionKind.DISAGREE: -1,
+    ReactionKind.PROOF: 1,
+    ReactionKind.DISPROOF: -1,
+    ReactionKind.ACCEPT: 1,
+    ReactionKind.REJECT: -1,
+    ReactionKind.LIKE: 1,
+    ReactionKind.DISLIKE: -1
+}
+
+
+def reaction_kind(reaction):
+    kind = reaction.kind
+    return ReactionKind[kind] if isinstance(kind, str) else kind
+
+
+def reaction_rating(reaction):
+    # do not count comments' reactions
+    if reaction.replyTo is not None:
+        return 0
+    return RATING_KINDS.get(reaction_kind(reaction), 0)
+
+
+class ShoutStatStorage:
+    """ shout_stat table keeps reactions counters of every shout """
+
+    @staticmethod
+    def init(session):
+        if not session.query(ShoutStat).first():
+            print('[stat.shouts] shout_stat table is empty, rebuilding')
+            ShoutStatStorage.rebuild()
+
+    @staticmethod
+    def update(session, reaction, sign=1):
+        """ applies :reaction to its shout counters, sign=-1 reverts it """
+        is_comment = reaction_kind(reaction) == ReactionKind.COMMENT
+        commented = sign if is_comment else 0
+        rating = sign * reaction_rating(reaction)
+        last_comment = reaction.createdAt if is_comment else None
+
+        q = insert(ShoutStat).values(
+            shout=reaction.shout,
+            reacted=sign,
+            commented=commented,
+            rating=rating,
+            lastComment=last_comment
+        )
+        if is_comment and sign < 0:
+            # the latest comment could be removed, so look it up again
+            last_comment = select(func.max(Reaction.createdAt)).where(
+                and_(
+                    Reaction.shout == reaction.shout,
+                    Reaction.kind == ReactionKind.COMMENT,
+                    Reaction.deletedAt.is_(None),
+                    Reaction.id != reaction.id
+                )
+            ).scalar_subquery()
+        else:
+            last_comment = func.greatest(ShoutStat.lastComment, q.excluded.lastComment)
+
+        q = q.on_conflict_do_update(
+            index_elements=[ShoutStat.shout],
+            set_={
+                "reacted": ShoutStat.reacted + sign,
+                "commented": ShoutStat.commented + commented,
+                "rating": ShoutStat.rating + rating,
+                "lastComment": last_comment
+            }
+        )
+        session.execute(q)
+
+    @staticmethod
+    def rebuild():
+        """ recounts all the stats from reaction table to fix a drift """
+        rating = case(
+            (Reaction.replyTo.is_not(None), 0),
+            *[(Reaction.kind == kind, value) for kind, value in RATING_KINDS.items()],
+            else_=0
+        )
+        q = select(
+            Reaction.shout,
+            func.count(Reaction.id),
+            func.sum(case((Reaction.kind == ReactionKind.COMMENT, 1), else_=0)),
+            func.sum(rating),
+            func.max(case((Reaction.kind == ReactionKind.COMMENT, Reaction.createdAt), else_=None))
+        ).where(
+            Reaction.deletedAt.is_(None)
+        ).group_by(Reaction.shout)
+
+        with local_session() as session:
+            session.execute(delete(ShoutStat))
+            session.execute(insert(ShoutStat).from_select(
+                ["shout", "reacted", "commented", "rating", "lastComment"], q
+            ))
+            session.commit()
+            print('[stat.shouts] %d shouts stat rebuilt' % session.query(ShoutStat).count())
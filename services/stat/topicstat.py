@@ -0,0 +1,76 @@
+from sqlalchemy import and_, delete, distinct, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from base.orm import local_session
+from orm.shout import Shout, ShoutAuthor, ShoutTopic
+from orm.topic import Topic, TopicFollower, TopicStat
+
+
+def shouts_and_authors():
+    """ topic id, shouts and authors counters of not deleted shouts """
+    return select(
+        Topic.id.label("topic"),
+        func.count(distinct(Shout.id)).label("shouts"),
+        func.count(distinct(ShoutAuthor.user)).label("authors")
+    ).outerjoin(
+        ShoutTopic, ShoutTopic.topic == Topic.id
+    ).outerjoin(
+        Shout, and_(Shout.id == ShoutTopic.shout, Shout.deletedAt.is_(None))
+    ).outerjoin(
+        ShoutAuthor, ShoutAuthor.shout == Shout.id
+    ).group_by(Topic.id)
+
+
+class TopicStatStorage:
+    """ topic_stat table keeps shouts, authors and followers counters of every topic """
+
+    @staticmethod
+    def init(session):
+        if not session.query(TopicStat).first():
+            print('[stat.topics] topic_stat table is empty, rebuilding')
+            TopicStatStorage.rebuild()
+
+    @staticmethod
+    def update(session, topic_id, **deltas):
+        """ adds :deltas to the topic counters, e.g. update(session, 1, followers=-1) """
+        q = insert(TopicStat).values(topic=topic_id, **deltas)
+        q = q.on_conflict_do_update(
+            index_elements=[TopicStat.topic],
+            set_={name: getattr(TopicStat, name) + delta for name, delta in deltas.items()}
+        )
+        session.execute(q)
+
+    @staticmethod
+    def refresh(session, topic_ids):
+        """
+        recounts shouts and authors of :topic_ids,
+        distinct authors can't be kept by increments
+        """
+        if not topic_ids:
+            return
+        q = insert(TopicStat).from_select(
+            ["topic", "shouts", "authors"],
+            shouts_and_authors().where(Topic.id.in_(topic_ids))
+        )
+        q = q.on_conflict_do_update(
+            index_elements=[TopicStat.topic],
+            set_={"shouts": q.excluded.shouts, "authors": q.excluded.authors}
+        )
+        session.execute(q)
+
+    @staticmethod
+    def rebuild():
+        """ recounts all the stats to fix a drift """
+        counted = shouts_and_authors().subquery()
+        followers = select(
+            TopicFollower.topic, func.count(TopicFollower.follower).label("followers")
+        ).group_by(TopicFollower.topic).subquery()
+        q = select(
+            counted.c.topic, counted.c.shouts, counted.c.authors, func.coalesce(followers.c.followers, 0)
+        ).outerjoin(followers, followers.c.topic == counted.c.topic)
+
+        with local_session() as session:
+            session.execute(delete(TopicStat))
+            session.execute(insert(TopicStat).from_select(["topic", "shouts", "authors", "followers"], q))
+            session.commit()
+            print('[stat.topics] %d topics stat rebuilt' % session.query(TopicStat).count())
@@ -6,10 +6,10 @@ from ssl import create_default_context
 
 from gql import Client, gql
 from gql.transport.aiohttp import AIOHTTPTransport
-from sqlalchemy import func
+from sqlalchemy import Integer, String, column, select, update, values
 
-from base.orm import local_session
-from orm import User, Topic
+from base.orm import async_session, local_session
+from orm import Topic
 from orm.shout import ShoutTopic, Shout
 
 load_facts = gql("""
@@ -42,6 +42,7 @@ query getDomains {
     }
 }
 """)
+UPDATE_CHUNK_SIZE = 5000  # (slug, views) rows in one UPDATE ... FROM (VALUES ...)
 schema_str = open(path.dirname(__file__) + '/ackee.graphql').read()
 token = environ.get("ACKEE_TOKEN", "")
 
@@ -93,15 +94,12 @@ class ViewedStorage:
             self.pages = await self.client.execute_async(load_pages)
             self.pages = self.pages["domains"][0]["statistics"]["pages"]
             shouts = {}
-            try:
-                for page in self.pages:
-                    p = page["value"].split("?")[0]
-                    slug = p.split('discours.io/')[-1]
-                    shouts[slug] = page["count"]
-                for slug in shouts.keys():
-                    await ViewedStorage.increment(slug, shouts[slug])
-            except Exception:
-                pass
+            for page in self.pages:
+                p = page["value"].split("?")[0]
+                slug = p.split('discours.io/')[-1]
+                shouts[slug] = page["count"]
+            await ViewedStorage.update_views(shouts)
+            await ViewedStorage.update_topics()
             print("[stat.viewed] ⎪ %d pages collected " % len(shouts.keys()))
         except Exception as e:
             raise e
@@ -128,7 +126,6 @@ class ViewedStorage:
                     try:
                         shout = session.query(Shout).where(Shout.slug == shout_slug).one()
                         self.by_shouts[shout_slug] = shout.views
-                        self.update_topics(session, shout_slug)
                     except Exception as e:
                         raise e
 
@@ -145,43 +142,60 @@ class ViewedStorage:
         return topic_views
 
     @staticmethod
-    def update_topics(session, shout_slug):
-        """ updates topics counters by shout slug """
+    async def update_topics():
+        """ rebuilds shouts and topics counters with one query """
         self = ViewedStorage
-        for [shout_topic, topic] in session.query(ShoutTopic, Topic).join(Topic).join(Shout).where(
-            Shout.slug == shout_slug
-        ).all():
-            if not self.by_topics.get(topic.slug):
-                self.by_topics[topic.slug] = {}
-            self.by_topics[topic.slug][shout_slug] = self.by_shouts[shout_slug]
+        by_shouts = {}
+        by_topics = {}
+        q = select(Shout.slug, Shout.views, Topic.slug).outerjoin(
+            ShoutTopic, ShoutTopic.shout == Shout.id
+        ).outerjoin(Topic, Topic.id == ShoutTopic.topic)
+        async with async_session() as session:
+            for [shout_slug, views, topic_slug] in await session.execute(q):
+                by_shouts[shout_slug] = views or 0
+                if topic_slug:
+                    by_topics.setdefault(topic_slug, {})[shout_slug] = views or 0
+        async with self.lock:
+            self.by_shouts = by_shouts
+            self.by_topics = by_topics
+
+    @staticmethod
+    async def update_views(views, viewer='ackee'):
+        """ sets :views counters by shout slug, all of them in one transaction """
+        field = 'viewsOld' if viewer == 'old-discours' else 'viewsAckee'
+        counter = getattr(Shout, field)
+        rows = list(views.items())
+        updated = 0
+        async with async_session() as session:
+            # chunks keep the statement under the bind parameters limit
+            for start in range(0, len(rows), UPDATE_CHUNK_SIZE):
+                v = values(column("slug", String), column("views", Integer), name="v").data(
+                    rows[start:start + UPDATE_CHUNK_SIZE]
+                )
+                q = update(Shout).where(
+                    Shout.slug == v.c.slug
+                ).where(
+                    counter.is_distinct_from(v.c.views)
+                ).values(
+                    {field: v.c.views}
+                ).execution_options(synchronize_session=False)
+                updated += (await session.execute(q)).rowcount
+            await session.commit()
+        print("[stat.viewed] ⎪ %d shouts views changed" % updated)
 
     @staticmethod
     async def increment(shout_slug, amount=1, viewer='ackee'):
         """ the only way to change views counter """
         self = ViewedStorage
+        await self.update_views({shout_slug: amount}, viewer)
+        # :amount is one viewer's counter, the cached ones are the sum of both
+        async with async_session() as session:
+            views = (await session.execute(select(Shout.views).where(Shout.slug == shout_slug))).scalar()
         async with self.lock:
-            # TODO optimize, currenty we execute 1 DB transaction per shout
-            with local_session() as session:
-                shout = session.query(Shout).where(Shout.slug == shout_slug).one()
-                if viewer == 'old-discours':
-                    # this is needed for old db migration
-                    if shout.viewsOld == amount:
-                        print(f"viewsOld amount: {amount}")
-                    else:
-                        print(f"viewsOld amount changed: {shout.viewsOld} --> {amount}")
-                        shout.viewsOld = amount
-                else:
-                    if shout.viewsAckee == amount:
-                        print(f"viewsAckee amount: {amount}")
-                    else:
-                        print(f"viewsAckee amount changed: {shout.viewsAckee} --> {amount}")
-                        shout.viewsAckee = amount
-
-                session.commit()
-
-                # this part is currently unused
-                self.by_shouts[shout_slug] = self.by_shouts.get(shout_slug, 0) + amount
-                self.update_topics(session, shout_slug)
+            self.by_shouts[shout_slug] = views or 0
+            for topic_views in self.by_topics.values():
+                if shout_slug in topic_views:
+                    topic_views[shout_slug] = views or 0
 
     @staticmethod
     async def worker():
@@ -0,0 +1,163 @@
+from sqlalchemy import and_, select, union
+from sqlalchemy.sql.expression import desc
+
+from base.orm import async_session
+from base.redis import redis
+from orm.shout import Shout, ShoutAuthor, ShoutTopic
+from orm.topic import Topic, TopicFollower
+from orm.user import AuthorFollower, User
+
+FEED_SIZE = 1000  # newest shouts kept for every user
+FEED_TTL = 30 * 24 * 60 * 60  # feeds of inactive users are rebuilt on demand
+FANOUT_CHUNK = 1000  # followers per pipeline
+EMPTY = 0  # the member kept below all the shouts, so a built feed exists even when nothing is followed
+
+# KEYS[1] - feed, ARGV - id and score of the last shout on the previous page, limit
+# the page goes on right below the shout, or below its score if the shout has left the feed meanwhile,
+# shouts of the same score come in the reverse order of their members there
+PAGE_AFTER = """
+local limit = tonumber(ARGV[3])
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[1])
+if rank then
+    return redis.call('ZREVRANGEBYSCORE', KEYS[1], '+inf', '(-inf', 'LIMIT', rank + 1, limit)
+end
+local page = {}
+local ties = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[2], ARGV[2])
+for _, member in ipairs(ties) do
+    if member < ARGV[1] and #page < limit then
+        table.insert(page, member)
+    end
+end
+if #page < limit then
+    local rest = redis.call('ZREVRANGEBYSCORE', KEYS[1], '(' .. ARGV[2], '(-inf', 'LIMIT', 0, limit - #page)
+    for _, member in ipairs(rest) do
+        table.insert(page, member)
+    end
+end
+return page
+"""
+
+
+def feed_key(user_id):
+    return f"feed/{user_id}"
+
+
+def published_shouts():
+    return select(Shout.id, Shout.publishedAt).where(
+        and_(
+            Shout.publishedAt.is_not(None),
+            Shout.deletedAt.is_(None)
+        )
+    ).order_by(desc(Shout.publishedAt)).limit(FEED_SIZE)
+
+
+class FeedStorage:
+    """ every user's home feed is a redis sorted set of shout ids scored by publishedAt """
+
+    @staticmethod
+    async def add(user_id, q):
+        """ merges shouts selected by :q into the feed """
+        async with async_session() as session:
+            shouts = (await session.execute(q)).all()
+        if shouts:
+            key = feed_key(user_id)
+            async with redis.pipeline() as pipe:
+                pipe.execute("ZADD", key, *[v for [shout_id, published_at] in shouts for v in (
+                    published_at.timestamp(), shout_id
+                )])
+                pipe.execute("ZREMRANGEBYRANK", key, 0, -FEED_SIZE - 1)
+                pipe.execute("EXPIRE", key, FEED_TTL)
+
+    @staticmethod
+    async def rebuild(user_id):
+        followed_authors = select(ShoutAuthor.shout).join(
+            AuthorFollower, AuthorFollower.author == ShoutAuthor.user
+        ).where(AuthorFollower.follower == user_id)
+        followed_topics = select(ShoutTopic.shout).join(
+            TopicFollower, TopicFollower.topic == ShoutTopic.topic
+        ).where(TopicFollower.follower == user_id)
+
+        async with redis.transaction() as tr:
+            tr.execute("DEL", feed_key(user_id))
+            tr.execute("ZADD", feed_key(user_id), "-inf", EMPTY)
+            tr.execute("EXPIRE", feed_key(user_id), FEED_TTL)
+        await FeedStorage.add(user_id, published_shouts().where(
+            Shout.id.in_(union(followed_authors, followed_topics))
+        ))
+
+    @staticmethod
+    async def forget(user_id):
+        """ unfollowed shouts are hard to pick out, the feed is built again on the next read """
+        await redis.execute("DEL", feed_key(user_id))
+
+    @staticmethod
+    async def follow_author(user_id, slug):
+        if await redis.execute("EXISTS", feed_key(user_id)):
+            q = published_shouts().join(ShoutAuthor).join(User, User.id == ShoutAuthor.user).where(User.slug == slug)
+            await FeedStorage.add(user_id, q)
+
+    @staticmethod
+    async def follow_topic(user_id, slug):
+        if await redis.execute("EXISTS", feed_key(user_id)):
+            q = published_shouts().join(ShoutTopic).join(Topic, Topic.id == ShoutTopic.topic).where(Topic.slug == slug)
+            await FeedStorage.add(user_id, q)
+
+    @staticmethod
+    async def fanout(shout_id):
+        """ adds just published shout to the feeds of its authors' and topics' followers """
+        async with async_session() as session:
+            shout = (await session.execute(select(Shout).where(Shout.id == shout_id))).scalar_one_or_none()
+            if not shout or not shout.publishedAt:
+                return
+            authors_followers = select(AuthorFollower.follower).join(
+                ShoutAuthor, ShoutAuthor.user == AuthorFollower.author
+            ).where(ShoutAuthor.shout == shout_id)
+            topics_followers = select(TopicFollower.follower).join(
+                ShoutTopic, ShoutTopic.topic == TopicFollower.topic
+            ).where(ShoutTopic.shout == shout_id)
+            followers = (await session.execute(union(authors_followers, topics_followers))).scalars().all()
+
+        score = shout.publishedAt.timestamp()
+        for start in range(0, len(followers), FANOUT_CHUNK):
+            chunk = followers[start:start + FANOUT_CHUNK]
+            async with redis.pipeline() as pipe:
+                for follower in chunk:
+                    pipe.execute("EXISTS", feed_key(follower))
+            # missing feeds are built from scratch on the next read
+            async with redis.pipeline() as pipe:
+                for follower, exists in zip(chunk, pipe.results):
+                    if exists:
+                        pipe.execute("ZADD", feed_key(follower), score, shout_id)
+                        pipe.execute("ZREMRANGEBYRANK", feed_key(follower), 0, -FEED_SIZE - 1)
+        print("[zine.feed] shout %d is sent to %d followers" % (shout_id, len(followers)))
+
+    @staticmethod
+    async def get(user_id, offset=0, limit=FEED_SIZE, after=None):
+        """
+        shout ids from the newest, :after is the (publishedAt, id) pair of the last shout on the previous page,
+        the EMPTY member below everything is never counted against :limit
+        """
+        key = feed_key(user_id)
+        if not await redis.execute("EXISTS", key):
+            await FeedStorage.rebuild(user_id)
+        else:
+            await redis.execute("EXPIRE", key, FEED_TTL)
+        if after:
+            published_at, shout_id = after
+            ids = await redis.evalsha(PAGE_AFTER, [key], [shout_id, repr(published_at.timestamp()), limit])
+        else:
+            ids = await redis.execute("ZREVRANGEBYSCORE", key, "+inf", "(-inf", "LIMIT", offset, limit)
+        return [int(shout_id) for shout_id in ids or [] if int(shout_id) != EMPTY]
+
+    @staticmethod
+    async def backfill():
+        """ builds the feeds of everyone following something """
+        followers = union(select(AuthorFollower.follower), select(TopicFollower.follower))
+        async with async_session() as session:
+            user_ids = (await session.execute(followers)).scalars().all()
+        print("[zine.feed] building %d feeds" % len(user_ids))
+        for i, user_id in enumerate(user_ids, 1):
+            await FeedStorage.rebuild(user_id)
+            if i % 1000 == 0:
+                print("[zine.feed] %d feeds built" % i)
+        print("[zine.feed] backfill done")
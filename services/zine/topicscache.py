@@ -0,0 +1,129 @@
+import asyncio
+import json
+import random
+from hashlib import sha1
+
+from sqlalchemy import func, select
+
+from base.orm import async_session
+from base.redis import redis
+from orm.topic import Topic, TopicStat
+
+VERSION_KEY = "topics/version"
+UPDATED_CHANNEL = "topics/updated"
+FOLLOWERS_CHANNEL = "topics/followers"  # [topic id, followers added], applied in place
+RANDOM_MIN_SHOUTS = 3  # topics with fewer shouts are never offered at random
+
+
+class TopicsCache:
+    """
+    the whole topicsAll payload kept in memory of every worker,
+    reloaded on the first request after any worker has changed topics or their stat,
+    followers counters are changed in place and the body is made again on the next request
+    """
+    lock = asyncio.Lock()
+    stale = True
+    version = 0
+    topics = []
+    by_id = {}
+    eligible = []  # topics for topicsRandom
+    body = b"[]"  # topics as json for the http route
+    etag = None
+    changed = False  # counters changed since the body was made
+    saved_calls = 0  # requests served without a query
+
+    @staticmethod
+    async def load():
+        self = TopicsCache
+        q = select(Topic).outerjoin(TopicStat, TopicStat.topic == Topic.id).add_columns(
+            func.coalesce(TopicStat.shouts, 0),
+            func.coalesce(TopicStat.authors, 0),
+            func.coalesce(TopicStat.followers, 0)
+        ).order_by(Topic.id)
+        topics = []
+        async with async_session() as session:
+            for [topic, shouts_stat, authors_stat, followers_stat] in await session.execute(q):
+                topic = topic.dict()
+                topic["stat"] = {
+                    "shouts": shouts_stat,
+                    "authors": authors_stat,
+                    "followers": followers_stat
+                }
+                topics.append(topic)
+        self.topics = topics
+        self.by_id = {topic["id"]: topic for topic in topics}
+        self.eligible = [topic for topic in topics if topic["stat"]["shouts"] >= RANDOM_MIN_SHOUTS]
+        self.dump()
+        print("[zine.topicscache] %d topics loaded, version %d" % (len(topics), self.version))
+
+    @staticmethod
+    def dump():
+        self = TopicsCache
+        self.changed = False
+        self.body = json.dumps(self.topics, ensure_ascii=False).encode("utf-8")
+        self.etag = '"%s"' % sha1(self.body).hexdigest()[:16]
+
+    @staticmethod
+    async def get():
+        """ :return: cache itself with fresh topics, body and etag """
+        self = TopicsCache
+        if self.stale:
+            async with self.lock:
+                if self.stale:
+                    # invalidations coming while loading mark it stale again
+                    self.stale = False
+                    self.version = int(await redis.execute("GET", VERSION_KEY) or 0)
+                    try:
+                        await self.load()
+                    except Exception:
+                        self.stale = True
+                        raise
+        if self.changed:
+            self.dump()
+        return self
+
+    @staticmethod
+    async def random(amount):
+        """ :amount random topics having enough shouts """
+        self = await TopicsCache.get()
+        self.saved_calls += 1
+        if self.saved_calls % 1000 == 0:
+            print("[zine.topicscache] %d topicsRandom calls served from memory" % self.saved_calls)
+        return random.sample(self.eligible, min(amount, len(self.eligible)))
+
+    @staticmethod
+    async def invalidate():
+        """ drops the cache in every worker """
+        TopicsCache.stale = True
+        version = await redis.execute("INCR", VERSION_KEY)
+        await redis.execute("PUBLISH", UPDATED_CHANNEL, version)
+
+    @staticmethod
+    async def followed(topic_id, n):
+        """ adds :n to the followers of :topic_id in every worker, nothing is reloaded """
+        await redis.execute("PUBLISH", FOLLOWERS_CHANNEL, json.dumps([topic_id, n]))
+
+    @staticmethod
+    async def on_published(channel, data):
+        channel = channel.decode("utf-8") if isinstance(channel, bytes) else channel
+        if channel == UPDATED_CHANNEL:
+            if int(data) > TopicsCache.version:
+                TopicsCache.stale = True
+        elif channel == FOLLOWERS_CHANNEL:
+            topic_id, n = json.loads(data)
+            topic = TopicsCache.by_id.get(topic_id)
+            if topic:
+                topic["stat"]["followers"] += n
+                TopicsCache.changed = True
+
+    @staticmethod
+    async def worker():
+        """ async task worker listening for changes made by other workers """
+        while True:
+            try:
+                await redis.listen_pattern("topics/*", TopicsCache.on_published)
+            except Exception as e:
+                print("[zine.topicscache] listener error: %s" % e)
+            # changes could be missed while disconnected
+            TopicsCache.stale = True
+            await asyncio.sleep(1)
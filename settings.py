@@ -6,14 +6,26 @@ DB_URL = (
     environ.get("DATABASE_URL") or environ.get("DB_URL") or
     "postgresql://postgres@localhost:5432/discoursio"
 )
+ASYNC_DB_URL = environ.get("ASYNC_DB_URL") or "postgresql+asyncpg://" + DB_URL.split("://", 1)[1]
 JWT_ALGORITHM = "HS256"
 JWT_SECRET_KEY = environ.get("JWT_SECRET_KEY") or "8f1bd7696ffb482d8486dfbc6e7d16dd-secret-key"
 SESSION_TOKEN_LIFE_SPAN = 30 * 24 * 60 * 60  # 1 month in seconds
 ONETIME_TOKEN_LIFE_SPAN = 24 * 60 * 60  # 1 day in seconds
+SESSION_CACHE_SIZE = int(environ.get("SESSION_CACHE_SIZE") or 10000)  # verified tokens per worker
+SESSION_CACHE_TTL = 5 * 60  # 5 minutes in seconds
+PASSWORD_HASH_ROUNDS = int(environ.get("PASSWORD_HASH_ROUNDS") or 10)  # bcrypt cost, rehashed on sign in if changed
+PASSWORD_HASH_THREADS = int(environ.get("PASSWORD_HASH_THREADS") or 2)  # concurrent hashings per worker
+PASSWORD_HASH_QUEUE = int(environ.get("PASSWORD_HASH_QUEUE") or 64)  # waiting hashings before refusing
+SEARCH_CACHE_TTL = 5 * 60  # 5 minutes in seconds
+SEARCH_MODE = environ.get("SEARCH_MODE") or "fts"  # fts | index
+SEARCH_INDEX_PATH = environ.get("SEARCH_INDEX_PATH") or "search.idx"
 REDIS_URL = environ.get("REDIS_URL") or "redis://127.0.0.1"
 
 MAILGUN_API_KEY = environ.get("MAILGUN_API_KEY")
 MAILGUN_DOMAIN = environ.get("MAILGUN_DOMAIN")
+MAILGUN_API_URL = environ.get("MAILGUN_API_URL") or "https://api.mailgun.net/v3/%s/messages" % (
+    MAILGUN_DOMAIN or "discours.io"
+)
 
 OAUTH_PROVIDERS = ("GITHUB", "FACEBOOK", "GOOGLE")
 OAUTH_CLIENTS = {}
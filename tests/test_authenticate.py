@@ -0,0 +1,47 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("jwt", "starlette", "sqlalchemy", "graphql", "aioredis", "pydantic"):
+    pytest.importorskip(module)
+
+from starlette.requests import HTTPConnection  # noqa: E402
+
+from auth import tokenstorage  # noqa: E402
+from auth.authenticate import JWTAuthenticate  # noqa: E402
+from auth.jwtcodec import JWTCodec  # noqa: E402
+from settings import SESSION_TOKEN_HEADER  # noqa: E402
+
+
+def request_with(token):
+    return HTTPConnection({
+        "type": "http",
+        "headers": [(SESSION_TOKEN_HEADER.lower().encode(), token.encode())]
+    })
+
+
+def test_revoked_token_makes_an_anonymous_request(monkeypatch):
+    async def exist(payload, token):
+        return False  # logged out, session/{jti} is gone
+
+    monkeypatch.setattr(tokenstorage.TokenStorage, "exist", staticmethod(exist))
+    user = SimpleNamespace(id=1, email="revoked@example.com", phone=None)
+    token = JWTCodec.encode(user, datetime.now(tz=timezone.utc) + timedelta(hours=1), "revoked-jti")
+
+    credentials, user = asyncio.run(JWTAuthenticate().authenticate(request_with(token)))
+
+    assert user.user_id is None
+    assert not credentials.logged_in
+    assert credentials.error_message == "token is revoked"
+
+
+def test_expired_token_makes_an_anonymous_request():
+    user = SimpleNamespace(id=1, email="expired@example.com", phone=None)
+    token = JWTCodec.encode(user, datetime.now(tz=timezone.utc) - timedelta(hours=1), "expired-jti")
+
+    credentials, user = asyncio.run(JWTAuthenticate().authenticate(request_with(token)))
+
+    assert user.user_id is None
+    assert not credentials.logged_in
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_by_main(modules):
+    """ :modules of the list imported by `import main` in a fresh interpreter """
+    check = "import sys, main; print(' '.join(m for m in %r if m in sys.modules))" % modules
+    result = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def api_dependencies():
+    for module in ("ariadne", "starlette", "sqlalchemy", "aioredis", "uvicorn"):
+        pytest.importorskip(module)
+
+
+def test_transformers_not_imported_by_main():
+    assert "transformers" not in imported_by_main(["transformers"])
+
+
+def test_heavy_modules_not_imported_by_main():
+    from server import HEAVY_MODULES
+    assert imported_by_main(HEAVY_MODULES) == []
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("aioredis")
+
+from base.redis import RedisCache  # noqa: E402
+from services import outbox  # noqa: E402
+from services.outbox import BACKOFF, DEAD_KEY, MAX_ATTEMPTS, OUTBOX_KEY, PROCESSING_KEY, RETRY_KEY, \
+    EmailOutbox, batches, is_permanent  # noqa: E402
+
+# a database of its own, the outbox keys are wiped there before every test
+TEST_REDIS_URL = os.environ.get("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+def message(email, template="email_confirmation_ru", token="token"):
+    return {
+        "from": "discours.io <noreply@discours.io>",
+        "to": "%s <%s>" % (email.split("@")[0], email),
+        "email": email,
+        "subject": "Confirm email",
+        "template": template,
+        "variables": {"token": token}
+    }
+
+
+class FakeMailgun(ThreadingHTTPServer):
+    """ answers every post with the status set, keeps the forms posted, rejects the forms sent to :rejected """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MailgunHandler)
+        self.status = 200
+        self.rejected = set()
+        self.requests = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/v3/discours.io/messages" % self.server_address[1]
+
+
+class MailgunHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        form = parse_qs(body)
+        self.server.requests.append(form)
+        rejected = any(to.split("<")[-1].rstrip(">") in self.server.rejected for to in form["to"])
+        self.send_response(400 if rejected else self.server.status)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mailgun(monkeypatch):
+    server = FakeMailgun()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(outbox, "MAILGUN_API_URL", server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    cache = RedisCache(TEST_REDIS_URL)
+
+    async def connect():
+        await cache.connect()
+        await cache._instance.ping()
+        await cache.execute("DEL", OUTBOX_KEY, RETRY_KEY, DEAD_KEY, PROCESSING_KEY)
+        await cache.disconnect()
+
+    try:
+        asyncio.run(connect())
+    except Exception as e:
+        pytest.skip("redis is not available at %s: %s" % (TEST_REDIS_URL, e))
+    monkeypatch.setattr(outbox, "redis", cache)
+    return cache
+
+
+def run(redis, coroutine):
+    """ every test runs in its own loop, so the connection is made again in it """
+    async def main():
+        redis._instance = None
+        await redis.connect()
+        try:
+            return await coroutine
+        finally:
+            await redis.disconnect()
+    return asyncio.run(main())
+
+
+async def send_taken(mailgun):
+    """ one step of the worker """
+    async with httpx.AsyncClient(timeout=5) as client:
+        return await EmailOutbox.process(client)
+
+
+def test_batches_group_by_template_and_split_repeated_addresses():
+    messages = [
+        message("a@example.com"),
+        message("b@example.com"),
+        message("a@example.com", token="second"),
+        message("c@example.com", template="password_reset_ru")
+    ]
+    grouped = [sorted(m["email"] for m in batch) for batch in batches(messages)]
+    assert sorted(grouped) == [["a@example.com"], ["a@example.com", "b@example.com"], ["c@example.com"]]
+
+
+def test_one_request_with_recipient_variables(redis, mailgun):
+    async def scenario():
+        await EmailOutbox.push(message("a@example.com", token="ta"))
+        await EmailOutbox.push(message("b@example.com", token="tb"))
+        await send_taken(mailgun)
+        return await redis.execute("ZCARD", PROCESSING_KEY)
+
+    assert run(redis, scenario()) == 0
+    [form] = mailgun.requests
+    assert sorted(form["to"]) == ["a <a@example.com>", "b <b@example.com>"]
+    assert json.loads(form["recipient-variables"][0]) == {
+        "a@example.com": {"token": "ta"},
+        "b@example.com": {"token": "tb"}
+    }
+    assert json.loads(form["h:X-Mailgun-Variables"][0]) == {"token": "%recipient.token%"}
+
+
+def test_server_errors_are_retried_with_backoff(redis, mailgun):
+    mailgun.status = 503
+
+    async def scenario():
+        await EmailOutbox.push(message("a@example.com"))
+        await send_taken(mailgun)
+        retries = await redis.execute("ZRANGE", RETRY_KEY, 0, -1)
+        due = [await redis.execute("ZSCORE", RETRY_KEY, retry) for retry in retries]
+        # not due yet
+        taken = await EmailOutbox.take()
+        return list(zip(retries, due)), taken, await redis.execute("ZCARD", PROCESSING_KEY)
+
+    started = time.time()
+    retries, taken, processing = run(redis, scenario())
+    [(retry, due)] = retries
+    assert json.loads(retry)["attempts"] == 1
+    assert started + BACKOFF <= float(due) <= time.time() + BACKOFF
+    assert taken == []
+    assert processing == 0
+
+
+def test_due_retry_is_sent_again(redis, mailgun):
+    async def scenario():
+        failed = dict(message("a@example.com"), attempts=2, error="503")
+        await redis.execute("ZADD", RETRY_KEY, time.time() - 1, json.dumps(failed))
+        await send_taken(mailgun)
+        return await redis.execute("ZCARD", RETRY_KEY)
+
+    assert run(redis, scenario()) == 0
+    assert len(mailgun.requests) == 1
+
+
+def test_client_errors_and_last_attempts_go_to_dead_letters(redis, mailgun):
+    mailgun.status = 400
+
+    async def scenario():
+        await EmailOutbox.push(message("a@example.com"))
+        await send_taken(mailgun)
+        mailgun.status = 500
+        exhausted = dict(message("b@example.com"), attempts=MAX_ATTEMPTS - 1)
+        await redis.execute("LPUSH", OUTBOX_KEY, json.dumps(exhausted))
+        await send_taken(mailgun)
+        return await redis.execute("LRANGE", DEAD_KEY, 0, -1), await redis.execute("ZCARD", RETRY_KEY)
+
+    dead, retries = run(redis, scenario())
+    assert sorted(json.loads(m)["email"] for m in dead) == ["a@example.com", "b@example.com"]
+    assert retries == 0
+
+
+def test_rejected_batch_is_split_and_only_bad_addresses_are_dead(redis, mailgun):
+    mailgun.rejected = {"bad@example.com"}
+
+    async def scenario():
+        for email in ("a@example.com", "bad@example.com", "b@example.com"):
+            await EmailOutbox.push(message(email))
+        taken = await send_taken(mailgun)
+        return taken, await redis.execute("LRANGE", DEAD_KEY, 0, -1), await redis.execute("ZCARD", RETRY_KEY)
+
+    taken, dead, retries = run(redis, scenario())
+    assert taken == 3
+    assert [json.loads(m)["email"] for m in dead] == ["bad@example.com"]
+    assert retries == 0
+    # the batch and then every recipient alone
+    assert len(mailgun.requests) == 4
+
+
+def test_permanent_errors():
+    assert is_permanent(httpx.Response(400))
+    assert not is_permanent(httpx.Response(429))
+    assert not is_permanent(httpx.Response(503))
+
+
+def test_messages_of_a_crashed_worker_are_taken_again(redis, mailgun):
+    async def scenario():
+        await EmailOutbox.push(message("a@example.com"))
+        taken = await EmailOutbox.take()
+        # the worker dies here without sending
+        before_timeout = await EmailOutbox.take()
+        after_timeout = await EmailOutbox.take(now=time.time() + outbox.PROCESSING_TIMEOUT + 1)
+        return taken, before_timeout, after_timeout
+
+    taken, before_timeout, after_timeout = run(redis, scenario())
+    assert [m["email"] for m in taken] == ["a@example.com"]
+    assert before_timeout == []
+    assert after_timeout == taken
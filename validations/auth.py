@@ -15,3 +15,4 @@ class TokenPayload(BaseModel):
     exp: int
     iat: int
     iss: Text
+    jti: Optional[Text]  # tokens issued before the session index have none